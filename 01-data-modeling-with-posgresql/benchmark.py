@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import resource
+import argparse
+import platform
+import multiprocessing
+from datetime import datetime
+import psycopg2
+import etl
+import create_tables
+from data_generator import generate_data, parse_scale, SCALES
+
+TABLES = ('songs', 'artists', 'users', 'time', 'songplays')
+
+# ETL configurations compared by the benchmark, values are command line arguments of `etl.py`
+MODES = {
+    'row': ['--mode', 'row', '--lookup', 'query', '--song-chunk-size', '0'],
+    'row-lookup': ['--mode', 'row'],
+    'copy': ['--mode', 'copy'],
+    'copy-bulk': ['--mode', 'copy', '--bulk'],
+    'copy-parallel': ['--mode', 'copy', '--workers', str(os.cpu_count() or 1)],
+    'staging': ['--mode', 'staging'],
+}
+
+
+def count_rows():
+    """Return number of rows in every table of sparkifydb."""
+
+    conn = psycopg2.connect(etl.DSN)
+    cur = conn.cursor()
+
+    counts = {}
+    for table in TABLES:
+        cur.execute('SELECT COUNT(*) FROM {};'.format(table))
+        counts[table] = cur.fetchone()[0]
+
+    conn.close()
+    return counts
+
+
+def run_mode(mode, data_dir, partitioned, queue):
+    """
+    Recreate sparkifydb, load the dataset with the ETL pipeline in the given mode and put results to the queue.
+    It is run in a separate process, so peak memory usage is measured for this mode only.
+    """
+
+    cur, conn = create_tables.create_database()
+    create_tables.drop_tables(cur, conn)
+    create_tables.create_tables(cur, conn, partitioned=partitioned)
+    conn.close()
+
+    args = etl.build_parser().parse_args(MODES[mode] + ['--full', '--data-dir', data_dir])
+
+    start = time.perf_counter()
+    stats = etl.run(args)
+    seconds = time.perf_counter() - start
+
+    rows = count_rows()
+    log_seconds = stats['log_data']['seconds']
+
+    # ru_maxrss is in kilobytes on Linux, workers are children of this process
+    queue.put({
+        'mode': mode,
+        'arguments': MODES[mode],
+        'seconds': seconds,
+        'stages': stats,
+        'rows': rows,
+        'rows_per_second': sum(rows.values()) / seconds,
+        'songplays_per_second': rows['songplays'] / log_seconds if log_seconds else 0,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_worker_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    })
+
+
+def run_benchmark(modes, data_dir, partitioned):
+    """Run the ETL pipeline in every mode against the same dataset and return list of results."""
+
+    results = []
+    for mode in modes:
+        print('Benchmark mode {}...'.format(mode))
+
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_mode, args=(mode, data_dir, partitioned, queue))
+        process.start()
+        process.join()
+
+        # result is small enough to stay in the queue buffer until the process exits
+        if process.exitcode != 0:
+            print('Mode {} failed with exit code {}'.format(mode, process.exitcode))
+            results.append({'mode': mode, 'error': 'exit code {}'.format(process.exitcode)})
+            continue
+
+        result = queue.get()
+
+        print('Mode {}: {:.2f} seconds, {:.0f} rows/s, peak RSS {:.1f} MB'.format(
+            mode, result['seconds'], result['rows_per_second'], result['peak_rss_mb']))
+        results.append(result)
+
+    return results
+
+
+def main():
+    """Generate synthetic dataset if required, run benchmark for all chosen modes and save results to JSON file."""
+
+    parser = argparse.ArgumentParser(description='Benchmark the ETL pipeline on synthetic Sparkify dataset.')
+    parser.add_argument('--scale', default='1k', help='number of events: {} or any number'.format(', '.join(SCALES)))
+    parser.add_argument('--modes', nargs='+', choices=MODES.keys(), default=['row', 'copy', 'staging'],
+                        help='ETL modes to compare')
+    parser.add_argument('--data-dir', default=None,
+                        help='directory with the dataset, generated if it does not exist; '
+                             'benchmark_data/<scale> by default')
+    parser.add_argument('--partitioned', action='store_true', help='partition songplays table by months')
+    parser.add_argument('--output', default=None,
+                        help='JSON file with results, benchmark_<scale>_<timestamp>.json by default')
+    args = parser.parse_args()
+
+    num_events = parse_scale(args.scale)
+    data_dir = args.data_dir or os.path.join('benchmark_data', args.scale)
+    if not os.path.exists(data_dir):
+        generate_data(data_dir, num_events)
+
+    started_at = datetime.now()
+    results = run_benchmark(args.modes, data_dir, args.partitioned)
+
+    output = args.output or 'benchmark_{}_{}.json'.format(args.scale, started_at.strftime('%Y%m%d-%H%M%S'))
+    with open(output, 'w', encoding='utf8') as f:
+        json.dump({
+            'started_at': started_at.isoformat(),
+            'scale': args.scale,
+            'events': num_events,
+            'data_dir': data_dir,
+            'partitioned': args.partitioned,
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'results': results,
+        }, f, indent=2)
+
+    print('Results are saved to {}'.format(output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import time
+import threading
+import functools
+import psycopg2
+from load_manifest import record_file, LOADED, FAILED
+from partitions import forget_partitions
+from metrics import metrics
+
+# Callbacks registered by the file which is processed by the current thread, see `on_commit`
+local = threading.local()
+
+
+def on_commit(callback):
+    """
+    Call the function when the file which is processed by the current thread is committed,
+    for example to update in-memory state which has to be consistent with the database.
+    Callbacks of the files which are rolled back are dropped. Outside of `TransactionBatch` it is called at once.
+    """
+
+    callbacks = getattr(local, 'callbacks', None)
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append(callback)
+
+
+class CommitPolicy:
+    """
+    Defines when the transaction with processed files is committed: after given number of files,
+    given number of records or given number of seconds since the beginning of the transaction,
+    whichever comes first. By default every file is committed separately.
+    """
+
+    def __init__(self, files=1, records=None, seconds=None):
+        self.files = files
+        self.records = records
+        self.seconds = seconds
+
+    def should_commit(self, files, records, seconds):
+        """Return True if the transaction with given number of files and records open for given seconds is full."""
+
+        return ((self.files is not None and files >= self.files)
+                or (self.records is not None and records >= self.records)
+                or (self.seconds is not None and seconds >= self.seconds))
+
+
+class TransactionBatch:
+    """
+    Transaction which covers several processed files and is committed according to the commit policy.
+
+    Every file (or chunk of files) is processed inside its own savepoint, so the failed file is rolled back alone
+    and recorded as failed in the load manifest while the rest of the transaction is kept. If the commit itself
+    fails then files of the transaction are processed again one per transaction, files whose own commit fails too
+    are recorded as failed. Files are recorded in the load
+    manifest in the same transaction as their data, so the restart after the crash is exact.
+    Counters of the files and callbacks registered with `on_commit` are applied only when the files are committed,
+    timers are added at once.
+    """
+
+    def __init__(self, cur, conn, policy):
+        self.cur = cur
+        self.conn = conn
+        self.policy = policy
+        self._reset()
+
+    def _reset(self):
+        self.pending = []
+        self.records = 0
+        self.started = time.monotonic()
+
+    def process(self, func, datafiles):
+        """Process chunk of files by single call of process function and commit the transaction if it is full."""
+
+        records, callbacks = self._process_in_savepoint(func, datafiles)
+        self.pending.append((func, datafiles, callbacks))
+        self.records += records
+
+        num_files = sum(len(files) for _, files, _ in self.pending)
+        if self.policy.should_commit(num_files, self.records, time.monotonic() - self.started):
+            self.commit()
+
+    def _process_in_savepoint(self, func, datafiles):
+        """
+        Process chunk of files and record it in the load manifest.
+        Return number of processed records and list of callbacks which have to be called after the commit.
+        Process function may return number of processed records if they are not counted by the `records` counter
+        during its call, for example if the files were parsed beforehand.
+        """
+
+        start = time.perf_counter()
+        local.callbacks = callbacks = []
+
+        try:
+            with metrics.collect() as counters:
+                self.cur.execute('SAVEPOINT file_load;')
+                try:
+                    processed = func(self.cur, datafiles)
+                    with metrics.timer('manifest'):
+                        for datafile in datafiles:
+                            record_file(self.cur, datafile, LOADED)
+                    self.cur.execute('RELEASE SAVEPOINT file_load;')
+                except Exception as e:
+                    # counters and callbacks of the rolled back file are dropped
+                    self.cur.execute('ROLLBACK TO SAVEPOINT file_load;')
+                    forget_partitions()
+                    for datafile in datafiles:
+                        record_file(self.cur, datafile, FAILED)
+                    print('Failed to process {}: {}'.format(', '.join(datafiles), e))
+                    return 0, [functools.partial(metrics.count, 'failed_files', len(datafiles))]
+        finally:
+            local.callbacks = None
+
+        records = processed if processed is not None else counters['records']
+        callbacks.append(functools.partial(metrics.add_counters, counters))
+        callbacks.append(functools.partial(metrics.record_files, datafiles, records, time.perf_counter() - start))
+        return records, callbacks
+
+    def commit(self):
+        """
+        Commit the transaction, if it fails then process files of the transaction one per transaction.
+        Callbacks of the files are called after their commit.
+        """
+
+        if not self.pending:
+            return
+
+        pending = self.pending
+        self._reset()
+
+        try:
+            with metrics.timer('commit'):
+                self.conn.commit()
+        except psycopg2.Error as e:
+            self.conn.rollback()
+            forget_partitions()
+            print('Failed to commit {} files: {}. Retry files one by one.'.format(len(pending), e))
+
+            for func, datafiles, _ in pending:
+                self._retry(func, datafiles)
+            return
+
+        for _, _, callbacks in pending:
+            for callback in callbacks:
+                callback()
+
+    def _retry(self, func, datafiles):
+        """
+        Process chunk of files again in its own transaction after the failed commit of the batch.
+        If this commit fails too then the files are recorded as failed and the next files are retried.
+        """
+
+        _, callbacks = self._process_in_savepoint(func, datafiles)
+        try:
+            with metrics.timer('commit'):
+                self.conn.commit()
+        except psycopg2.Error as e:
+            self.conn.rollback()
+            forget_partitions()
+            print('Failed to commit {}: {}'.format(', '.join(datafiles), e))
+            metrics.count('failed_files', len(datafiles))
+            try:
+                for datafile in datafiles:
+                    record_file(self.cur, datafile, FAILED)
+                self.conn.commit()
+            except psycopg2.Error:
+                # files which are not recorded in the load manifest are simply processed again by the next run
+                self.conn.rollback()
+            return
+
+        for callback in callbacks:
+            callback()
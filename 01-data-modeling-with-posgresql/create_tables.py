@@ -1,5 +1,7 @@
+import argparse
 import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+from sql_queries import (create_table_queries, create_partitioned_table_queries, drop_table_queries,
+                         songplay_index_queries)
 
 
 def create_database():
@@ -32,10 +34,17 @@ def drop_tables(cur, conn):
         conn.commit()
 
 
-def create_tables(cur, conn):
-    """Execute SQL-statements to create all required tables for sparkifydb."""
+def create_tables(cur, conn, partitioned=False):
+    """
+    Execute SQL-statements to create all required tables and indexes for sparkifydb.
+    If partitioned is set then `songplays` table is partitioned by months of `start_time`.
+    """
 
-    for query in create_table_queries:
+    for query in create_partitioned_table_queries if partitioned else create_table_queries:
+        cur.execute(query)
+        conn.commit()
+
+    for query in songplay_index_queries:
         cur.execute(query)
         conn.commit()
 
@@ -43,10 +52,15 @@ def create_tables(cur, conn):
 def main():
     """Recreate sparkifydb database from scratch."""
 
+    parser = argparse.ArgumentParser(description='Recreate sparkifydb database from scratch.')
+    parser.add_argument('--partitioned', action='store_true',
+                        help='partition songplays table by months, partitions are created by ETL pipeline')
+    args = parser.parse_args()
+
     cur, conn = create_database()
 
     drop_tables(cur, conn)
-    create_tables(cur, conn)
+    create_tables(cur, conn, partitioned=args.partitioned)
 
     conn.close()
 
@@ -0,0 +1,191 @@
+import os
+import json
+import random
+import string
+import argparse
+from datetime import datetime, timedelta
+
+FIRST_NAMES = ('Walter', 'Kaylee', 'Lily', 'Jacob', 'Layla', 'Tegan', 'Aleena', 'Ryan', 'Chloe', 'Mohammad')
+LAST_NAMES = ('Frye', 'Summers', 'Koch', 'Klein', 'Griffin', 'Levine', 'Kirby', 'Smith', 'Cuevas', 'Rodriguez')
+LOCATIONS = ('San Francisco-Oakland-Hayward, CA', 'Phoenix-Mesa-Scottsdale, AZ', 'Chicago-Naperville-Elgin, IL-IN-WI',
+             'Portland-South Portland, ME', 'Lansing-East Lansing, MI', 'Atlanta-Sandy Springs-Roswell, GA')
+USER_AGENTS = (
+    '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 '
+    'Safari/537.36"',
+    '"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.153 Safari/537.36"',
+    'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0',
+)
+PAGES = ('Home', 'Logout', 'Settings', 'Help', 'About', 'Upgrade', 'Downgrade')
+
+# Share of events which are NextSong events and share of songs from the events which exist in song_data
+NEXT_SONG_SHARE = 0.8
+KNOWN_SONG_SHARE = 0.9
+
+# Scale factors of the benchmark, number of events in log_data
+SCALES = {'1k': 1000, '100k': 100000, '10M': 10000000}
+
+
+def random_id(rng, prefix):
+    """Return random identifier in the Million Song Dataset format, for example SOMZWCG12A8C13C480."""
+
+    return prefix + ''.join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(16))
+
+
+def random_title(rng):
+    """Return random song title or artist name."""
+
+    return ' '.join(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 8))).capitalize()
+                    for _ in range(rng.randint(1, 4)))
+
+
+def generate_song_data(filepath, num_songs, rng):
+    """
+    Generate song files with single record per file in the same directory layout as the original song_data,
+    for example `song_data/A/A/A/TRAAAAW128F429D538.json`. Return list of generated songs.
+    """
+
+    num_artists = max(1, num_songs // 3)
+    artists = [{
+        'artist_id': random_id(rng, 'AR'),
+        'artist_name': random_title(rng),
+        'artist_location': rng.choice(LOCATIONS + ('',)),
+        'artist_latitude': round(rng.uniform(-90, 90), 5) if rng.random() < 0.4 else None,
+        'artist_longitude': round(rng.uniform(-180, 180), 5) if rng.random() < 0.4 else None,
+    } for _ in range(num_artists)]
+
+    songs = []
+    for _ in range(num_songs):
+        track_id = random_id(rng, 'TR')
+        record = {
+            'num_songs': 1,
+            **rng.choice(artists),
+            'song_id': random_id(rng, 'SO'),
+            'title': random_title(rng),
+            'duration': round(rng.uniform(60, 600), 5),
+            'year': rng.choice((0, rng.randint(1960, 2018))),
+        }
+
+        directory = os.path.join(filepath, track_id[2], track_id[3], track_id[4])
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, track_id + '.json'), 'w', encoding='utf8') as f:
+            json.dump(record, f)
+
+        songs.append(record)
+
+    return songs
+
+
+def generate_user(rng, user_id, start_ts):
+    """Return random user of the Sparkify service."""
+
+    return {
+        'userId': str(user_id),
+        'firstName': rng.choice(FIRST_NAMES),
+        'lastName': rng.choice(LAST_NAMES),
+        'gender': rng.choice('MF'),
+        'level': rng.choice(('free', 'paid')),
+        'location': rng.choice(LOCATIONS),
+        'userAgent': rng.choice(USER_AGENTS),
+        'registration': float(start_ts - rng.randint(0, 30 * 24 * 3600 * 1000)),
+    }
+
+
+def generate_log_data(filepath, num_events, songs, events_per_file, rng, start_date=datetime(2018, 11, 1)):
+    """
+    Generate log files with one file per day in the same layout as the original log_data,
+    for example `log_data/2018/11/2018-11-01-events.json`. Each file contains up to `events_per_file` events.
+    """
+
+    epoch = datetime(1970, 1, 1)
+    start_ts = int((start_date - epoch).total_seconds() * 1000)
+    users = [generate_user(rng, user_id, start_ts) for user_id in range(1, max(10, num_events // 100) + 1)]
+    session_id = 0
+
+    day = 0
+    remaining = num_events
+    while remaining > 0:
+        date = start_date + timedelta(days=day)
+        directory = os.path.join(filepath, str(date.year), '{:02d}'.format(date.month))
+        os.makedirs(directory, exist_ok=True)
+
+        num_day_events = min(events_per_file, remaining)
+        ms_per_event = 24 * 3600 * 1000 // num_day_events
+        ts = int((date - epoch).total_seconds() * 1000)
+
+        with open(os.path.join(directory, date.strftime('%Y-%m-%d-events.json')), 'w', encoding='utf8') as f:
+            item_in_session = 0
+            user = rng.choice(users)
+            for _ in range(num_day_events):
+                # start new session from time to time
+                if item_in_session == 0 or rng.random() < 0.05:
+                    session_id += 1
+                    item_in_session = 0
+                    user = rng.choice(users)
+                    if rng.random() < 0.05:
+                        user['level'] = 'paid' if user['level'] == 'free' else 'free'
+
+                event = {
+                    'artist': None, 'auth': 'Logged In', 'firstName': user['firstName'], 'gender': user['gender'],
+                    'itemInSession': item_in_session, 'lastName': user['lastName'], 'length': None,
+                    'level': user['level'], 'location': user['location'], 'method': 'GET',
+                    'page': rng.choice(PAGES), 'registration': user['registration'], 'sessionId': session_id,
+                    'song': None, 'status': 200, 'ts': ts, 'userAgent': user['userAgent'], 'userId': user['userId'],
+                }
+
+                if rng.random() < NEXT_SONG_SHARE:
+                    if songs and rng.random() < KNOWN_SONG_SHARE:
+                        song = rng.choice(songs)
+                        artist, title, length = song['artist_name'], song['title'], song['duration']
+                    else:
+                        artist, title, length = random_title(rng), random_title(rng), round(rng.uniform(60, 600), 5)
+                    event.update(artist=artist, song=title, length=length, page='NextSong', method='PUT')
+
+                f.write(json.dumps(event) + '\n')
+
+                item_in_session += 1
+                ts += ms_per_event
+
+        remaining -= num_day_events
+        day += 1
+
+
+def generate_data(filepath, num_events, num_songs=None, events_per_file=10000, seed=42):
+    """
+    Generate synthetic Sparkify dataset with `song_data` and `log_data` subdirectories in the given directory.
+    By default number of songs is 1% of the number of events.
+    """
+
+    rng = random.Random(seed)
+    num_songs = num_songs if num_songs is not None else max(10, num_events // 100)
+
+    songs = generate_song_data(os.path.join(filepath, 'song_data'), num_songs, rng)
+    generate_log_data(os.path.join(filepath, 'log_data'), num_events, songs, events_per_file, rng)
+
+    print('{} songs and {} events are generated in {}'.format(num_songs, num_events, filepath))
+
+
+def parse_scale(value):
+    """Return number of events for the scale factor like `1k`, `100k`, `10M` or plain number."""
+
+    if value in SCALES:
+        return SCALES[value]
+    return int(value)
+
+
+def main():
+    """Generate synthetic Sparkify dataset of the given scale."""
+
+    parser = argparse.ArgumentParser(description='Generate synthetic Sparkify song_data and log_data.')
+    parser.add_argument('path', help='output directory')
+    parser.add_argument('--events', type=parse_scale, default='1k',
+                        help='number of events: {} or any number'.format(', '.join(SCALES)))
+    parser.add_argument('--songs', type=int, default=None, help='number of songs, 1%% of events by default')
+    parser.add_argument('--events-per-file', type=int, default=10000, help='maximum number of events per log file')
+    parser.add_argument('--seed', type=int, default=42, help='seed of the random generator')
+    args = parser.parse_args()
+
+    generate_data(args.path, args.events, args.songs, args.events_per_file, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,81 +1,431 @@
 import os
+import io
+import csv
 import glob
+import json
+import time
+import cProfile
+import argparse
+import functools
+import multiprocessing
+from multiprocessing.util import Finalize
 import psycopg2
+import psycopg2.extras
 import pandas as pd
 from sql_queries import *
+from song_lookup import SongLookup
+from load_manifest import select_new_files
+from commit_policy import CommitPolicy, TransactionBatch, on_commit
+from partitions import ensure_songplay_partitions, create_songplay_partitions
+from metrics import metrics
 
+DSN = "host=127.0.0.1 dbname=sparkifydb user=student password=student"
 
-def process_song_file(cur, filepath):
+
+def process_song_file(cur, filepath, song_lookup=None):
     """
     Process single JSON file with information about song and artist,
     and insert extracted data to songs and artists tables in sparkifydb.
+    Inserted song is registered in the song lookup index if it is used, when the song is committed.
     """
 
-    # open song file
-    df = pd.read_json(filepath, lines=True)
+    # open song file, floats are parsed exactly as `json.loads` does, so durations match the log lengths
+    with metrics.timer('parse'):
+        df = pd.read_json(filepath, lines=True, precise_float=True)
+    metrics.count('records', len(df))
 
     # insert song record
     song_data = df[['song_id', 'title', 'artist_id', 'year', 'duration']].values[0].tolist()
-    cur.execute(song_table_insert, song_data)
+    with metrics.timer('song_insert'):
+        cur.execute(song_table_insert, song_data)
+    metrics.count('songs')
 
     # insert artist record
     artist_data = df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']].values[0].tolist()
-    cur.execute(artist_table_insert, artist_data)
+    with metrics.timer('artist_insert'):
+        cur.execute(artist_table_insert, artist_data)
+    metrics.count('artists')
+
+    if song_lookup is not None:
+        song_id, title, artist_id, year, duration = song_data
+        on_commit(functools.partial(song_lookup.add, title, artist_data[1], duration, song_id, artist_id))
+
+
+def read_json_records(filepaths):
+    """Read records from the JSON files without pandas, each line of the file is a single record."""
 
+    for filepath in filepaths:
+        with open(filepath, encoding='utf8') as f:
+            for line in f:
+                if line.strip():
+                    metrics.count('records')
+                    yield json.loads(line)
 
-def process_log_file(cur, filepath):
+
+def merge_record(records, key, record, update_fields):
     """
-    Process single JSON file with raw log information
-    and insert extracted data to users, time and songplays tables in sparkifydb.
+    Add record to the dictionary of deduplicated records by its key field.
+    Same as ON CONFLICT rules in `sql_queries.py` only update fields are overwritten
+    and only if the new value is not empty.
+    """
+
+    existing = records.get(record[key])
+    if existing is None:
+        records[record[key]] = record
+        return
+
+    for field in update_fields:
+        if record[field] is not None:
+            existing[field] = record[field]
+
+
+def parse_song_files(filepaths, song_lookup=None):
     """
+    Read chunk of JSON files with information about songs and artists and return lists of song rows and artist rows.
+    Songs and artists are deduplicated in memory, rows are sorted by key.
+    Parsed songs are registered in the song lookup index if it is used, when they are committed.
+    """
+
+    songs = {}
+    artists = {}
+    lookup_songs = []
+
+    # parsing and deduplication are measured together because records are read lazily
+    parse_start = time.perf_counter()
 
-    # open log file
-    df = pd.read_json(filepath, lines=True)
+    for record in read_json_records(filepaths):
+        song = {
+            'song_id': record['song_id'],
+            'title': record['title'],
+            'artist_id': record['artist_id'],
+            'year': record['year'],
+            'duration': record['duration'],
+        }
+        merge_record(songs, 'song_id', song, ('artist_id', 'year', 'duration'))
+
+        artist = {
+            'artist_id': record['artist_id'],
+            'name': record['artist_name'],
+            'location': record['artist_location'],
+            'latitude': record['artist_latitude'],
+            'longitude': record['artist_longitude'],
+        }
+        merge_record(artists, 'artist_id', artist, ('location', 'latitude', 'longitude'))
+
+        if song_lookup is not None:
+            lookup_songs.append((record['title'], record['artist_name'], record['duration'], record['song_id'],
+                                 record['artist_id']))
+
+    metrics.add_time('parse', time.perf_counter() - parse_start)
+
+    # songs rolled back with the failed file must not be found by the lookup
+    if song_lookup is not None:
+        on_commit(functools.partial(song_lookup.add_songs, lookup_songs))
+
+    # rows are sorted by key to avoid deadlocks between parallel workers which load overlapping keys
+    song_rows = [tuple(songs[song_id].values()) for song_id in sorted(songs)]
+    artist_rows = [tuple(artists[artist_id].values()) for artist_id in sorted(artists)]
+    return song_rows, artist_rows
+
+
+def insert_song_rows(cur, song_rows, artist_rows):
+    """Insert song and artist rows to songs and artists tables in sparkifydb with single multi-row upsert per table."""
+
+    if not song_rows:
+        return
+
+    with metrics.timer('song_insert'):
+        psycopg2.extras.execute_values(cur, song_table_bulk_upsert, song_rows, page_size=len(song_rows))
+    metrics.count('songs', len(song_rows))
+
+    with metrics.timer('artist_insert'):
+        psycopg2.extras.execute_values(cur, artist_table_bulk_upsert, artist_rows, page_size=len(artist_rows))
+    metrics.count('artists', len(artist_rows))
+
+
+def process_song_files(cur, filepaths, song_lookup=None):
+    """
+    Process chunk of JSON files with information about songs and artists
+    and insert extracted data to songs and artists tables in sparkifydb with single multi-row upsert per table.
+    Songs and artists are deduplicated in memory before the upsert.
+    Inserted songs are registered in the song lookup index if it is used, when they are committed.
+    """
 
-    # filter by NextSong action
-    df = df[df['page'] == 'NextSong']
+    insert_song_rows(cur, *parse_song_files(filepaths, song_lookup))
+
+
+def read_log_chunks(filepath, chunksize=None):
+    """
+    Read single JSON file with raw log information and yield DataFrames with NextSong events only.
+    If chunk size is set then the file is read by chunks of given number of lines,
+    so memory usage does not depend on the file size. Otherwise the whole file is returned as a single chunk.
+    Floats are parsed precisely, the same way as `json.loads` parses song durations in `parse_song_files`,
+    otherwise some lengths differ in the last digit and the songplays are not matched to their songs.
+    """
+
+    # open log file, in chunked mode the file is parsed lazily while the next chunk is requested
+    with metrics.timer('parse'):
+        if chunksize:
+            chunks = iter(pd.read_json(filepath, lines=True, precise_float=True, chunksize=chunksize))
+        else:
+            chunks = iter([pd.read_json(filepath, lines=True, precise_float=True)])
+
+    while True:
+        with metrics.timer('parse'):
+            df = next(chunks, None)
+        if df is None:
+            return
+        metrics.count('records', len(df))
+
+        # filter by NextSong action
+        with metrics.timer('filter'):
+            df = df[df['page'] == 'NextSong']
+        metrics.count('next_song_events', len(df))
+
+        yield df
+
+
+def get_time_df(df):
+    """Build DataFrame with time records from the NextSong events."""
 
     # convert timestamp column to datetime
     t = pd.to_datetime(df['ts'], unit='ms')
 
-    # insert time data records
     time_data = (t, t.dt.hour, t.dt.day, t.dt.week, t.dt.month, t.dt.year, t.dt.weekday)
     column_labels = ('start_time', 'hour', 'day', 'week', 'month', 'year', 'weekday')
-    time_df = pd.DataFrame(dict(zip(column_labels, time_data)))
+    return pd.DataFrame(dict(zip(column_labels, time_data)))
+
+
+def get_latest_time_df(df):
+    """Build DataFrame with time records from the NextSong events, one record per `start_time` in time order."""
 
-    for i, row in time_df.iterrows():
-        cur.execute(time_table_insert, list(row))
+    return get_time_df(df).drop_duplicates('start_time').sort_values('start_time')
+
+
+def get_latest_users_df(df):
+    """
+    Build DataFrame with users of the NextSong events, one record per user with the latest state by `ts`.
+    The same user appears in the log file hundreds of times, so the users table is updated once per user.
+    Records are sorted by user to avoid deadlocks between parallel workers which load overlapping users.
+    """
+
+    user_df = df[['userId', 'firstName', 'lastName', 'gender', 'level', 'ts']]
+
+    # stable sort keeps file order of events with the same `ts`, so the last of them wins
+    user_df = user_df.sort_values('ts', kind='mergesort').drop_duplicates('userId', keep='last')
+    return user_df.sort_values('userId')
+
+
+def get_months(df):
+    """Return set of (year, month) pairs of the events, it is used to create partitions of songplays table."""
+
+    t = pd.to_datetime(df['ts'], unit='ms')
+    return {(period.year, period.month) for period in t.dt.to_period('M').unique()}
+
+
+def update_rollups(cur):
+    """
+    Add songplays collected in the `songplay_delta` table to the rollup tables and clear the delta.
+    Songplays of the delta without matched song are counted by the `songplays_unmatched` counter.
+    """
+
+    cur.execute(songplay_delta_unmatched_select)
+    metrics.count('songplays_unmatched', cur.fetchone()[0])
+
+    with metrics.timer('rollup_update'):
+        for query in rollup_update_queries:
+            cur.execute(query)
+
+
+def insert_log_df(cur, df, song_lookup=None):
+    """
+    Insert NextSong events to users, time and songplays tables in sparkifydb row by row and update the rollups.
+    Songs are found with the song lookup index if it is used, otherwise with `song_select` query.
+    """
+
+    ensure_songplay_partitions(cur, get_months(df))
+    cur.execute(songplay_delta_create)
+
+    # insert time data records
+    with metrics.timer('time_insert'):
+        time_df = get_latest_time_df(df)
+
+        for i, row in time_df.iterrows():
+            cur.execute(time_table_insert, list(row))
+    metrics.count('time_rows', len(time_df))
 
     # load user table
-    user_df = df[['userId', 'firstName', 'lastName', 'gender', 'level']]
+    user_df = get_latest_users_df(df)[['userId', 'firstName', 'lastName', 'gender', 'level']]
 
     # insert user records
-    for i, row in user_df.iterrows():
-        cur.execute(user_table_insert, row)
+    with metrics.timer('user_insert'):
+        for i, row in user_df.iterrows():
+            cur.execute(user_table_insert, row)
+    metrics.count('users', len(user_df))
 
     # insert songplay records
     for index, row in df.iterrows():
 
         # get songid and artistid from song and artist tables
-        cur.execute(song_select, (row.song, row.artist, row.length))
-        results = cur.fetchone()
+        with metrics.timer('song_lookup'):
+            if song_lookup is not None:
+                songid, artistid = song_lookup.get(row.song, row.artist, row.length)
+            else:
+                cur.execute(song_select, (row.song, row.artist, row.length))
+                results = cur.fetchone()
 
-        if results:
-            songid, artistid = results
-        else:
-            songid, artistid = None, None
+                if results:
+                    songid, artistid = results
+                else:
+                    songid, artistid = None, None
 
         # insert songplay record
         songplay_data = (pd.to_datetime(row.ts, unit='ms'), row.userId, row.level, songid, artistid, row.sessionId,
                          row.location, row.userAgent)
-        cur.execute(songplay_table_insert, songplay_data)
+        with metrics.timer('songplay_insert'):
+            cur.execute(songplay_table_tracked_insert, songplay_data)
+        metrics.count('songplays')
+
+    update_rollups(cur)
 
 
-def process_data(cur, conn, filepath, func):
+def process_log_file(cur, filepath, song_lookup=None, chunksize=None):
     """
-    Create list of all song and log JSON files, process it one by one by calling process function for each file
-    and report progress to output.
+    Process single JSON file with raw log information
+    and insert extracted data to users, time and songplays tables in sparkifydb row by row.
+    If chunk size is set then the file is read and loaded chunk by chunk.
+    """
+
+    for df in read_log_chunks(filepath, chunksize):
+        insert_log_df(cur, df, song_lookup)
+
+
+def copy_df(cur, df, table):
+    """Stream DataFrame to the table with COPY FROM STDIN through in-memory CSV buffer."""
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    cur.copy_expert(copy_from_stdin.format(table=table, columns=', '.join(df.columns)), buffer)
+
+
+def copy_log_df(cur, df, song_lookup=None):
+    """
+    Bulk load NextSong events to users, time and songplays tables in sparkifydb and update the rollups.
+
+    Each DataFrame is copied to the temporary staging table and then moved to the target table
+    with single set-based INSERT, so the whole chunk of events costs a constant number of round trips.
+    Songs are resolved with the song lookup index before the COPY if it is used, otherwise during the INSERT.
+    """
+
+    ensure_songplay_partitions(cur, get_months(df))
+
+    # staging tables are temporary, so they have to be created for each new session
+    for query in staging_table_queries:
+        cur.execute(query)
+
+    # copy time data records
+    with metrics.timer('time_insert'):
+        time_df = get_latest_time_df(df)
+        copy_df(cur, time_df, 'time_staging')
+        cur.execute(time_table_bulk_insert)
+    metrics.count('time_rows', len(time_df))
+
+    # copy user records, userId is always set for NextSong events
+    with metrics.timer('user_insert'):
+        user_df = get_latest_users_df(df).astype({'userId': int})
+        user_df.columns = ['user_id', 'first_name', 'last_name', 'gender', 'level', 'ts']
+        copy_df(cur, user_df, 'user_staging')
+        cur.execute(user_table_bulk_insert)
+    metrics.count('users', len(user_df))
+
+    # copy songplay records
+    songplay_df = pd.DataFrame({
+        'start_time': pd.to_datetime(df['ts'], unit='ms'),
+        'user_id': df['userId'].astype(int),
+        'level': df['level'],
+        'song': df['song'],
+        'artist': df['artist'],
+        'length': df['length'],
+        'session_id': df['sessionId'],
+        'location': df['location'],
+        'user_agent': df['userAgent'],
+    })
+    if song_lookup is not None:
+        with metrics.timer('song_lookup'):
+            songplay_df['song_id'], songplay_df['artist_id'] = song_lookup.resolve(df)
+
+    # songs and artists are resolved during the insert if the song lookup index is not used
+    with metrics.timer('songplay_insert'):
+        copy_df(cur, songplay_df, 'songplay_staging')
+        cur.execute(songplay_table_tracked_resolved_bulk_insert if song_lookup is not None
+                    else songplay_table_tracked_bulk_insert)
+    metrics.count('songplays', cur.rowcount)
+
+    cur.execute(staging_truncate)
+    update_rollups(cur)
+
+
+def process_log_file_copy(cur, filepath, song_lookup=None, chunksize=None):
     """
+    Process single JSON file with raw log information
+    and bulk load extracted data to users, time and songplays tables in sparkifydb.
+    If chunk size is set then the file is read and loaded chunk by chunk.
+    """
+
+    for df in read_log_chunks(filepath, chunksize):
+        copy_log_df(cur, df, song_lookup)
+
+
+def copy_records(cur, records, table, columns):
+    """Stream JSON records to the staging table with COPY FROM STDIN through in-memory CSV buffer."""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        # empty values are loaded as NULLs
+        writer.writerow([record.get(column) for column in columns])
+    buffer.seek(0)
+    cur.copy_expert(copy_from_stdin.format(table=table, columns=', '.join(columns)), buffer)
+
+
+def process_song_files_staging(cur, filepaths):
+    """
+    Process chunk of JSON files with information about songs and artists:
+    copy raw records to the `stg_songs` staging table and merge them to songs and artists tables.
+    """
+
+    with metrics.timer('staging_copy'):
+        copy_records(cur, read_json_records(filepaths), 'stg_songs', staging_songs_columns)
+
+    with metrics.timer('staging_merge'):
+        for query in song_merge_queries:
+            cur.execute(query)
+
+
+def process_log_files_staging(cur, filepaths):
+    """
+    Process chunk of JSON files with raw log information:
+    copy raw events to the `stg_events` staging table, merge them to time, users and songplays tables
+    and update the rollups.
+    """
+
+    with metrics.timer('staging_copy'):
+        copy_records(cur, read_json_records(filepaths), 'stg_events', staging_events_columns)
+
+    cur.execute(staging_events_months_select)
+    ensure_songplay_partitions(cur, cur.fetchall())
+    cur.execute(songplay_delta_create)
+
+    with metrics.timer('staging_merge'):
+        for query in log_merge_queries:
+            cur.execute(query)
+
+    update_rollups(cur)
+
+
+def get_files(filepath):
+    """Return list of absolute paths to all JSON files in the directory and its subdirectories."""
 
     # get all files matching extension from directory
     all_files = []
@@ -84,28 +434,365 @@ def process_data(cur, conn, filepath, func):
         for f in files:
             all_files.append(os.path.abspath(f))
 
+    return all_files
+
+
+def as_chunk_func(func, chunked):
+    """Return process function which accepts chunk of files, single file function is called for the first file."""
+
+    if chunked:
+        return func
+    return lambda cur, datafiles: func(cur, datafiles[0])
+
+
+def find_files(cur, filepath, incremental, reload_changed=True):
+    """
+    Return list of files to process and report to output how many files are found.
+    Changed files which were loaded before are processed again only if `reload_changed` is set.
+    """
+
+    all_files = get_files(filepath)
+    print('{} files found in {}'.format(len(all_files), filepath))
+
+    if incremental:
+        all_files = select_new_files(cur, all_files, reload_changed)
+        print('{} files are new or changed since the last run'.format(len(all_files)))
+
+    return all_files
+
+
+def report_stats(filepath, num_files, seconds):
+    """Report to output how long it took to process the files and return it as a dictionary."""
+
+    print('{} files from {} processed in {:.2f} seconds.'.format(num_files, filepath, seconds))
+    if metrics.counters['failed_files']:
+        print('{} files failed, they are marked as failed in the load manifest and will be retried on the next run.'
+              .format(metrics.counters['failed_files']))
+
+    return {'files': num_files, 'seconds': seconds}
+
+
+def split_chunks(all_files, chunk_size):
+    """Split list of files to the chunks of the given size."""
+
+    return [all_files[i:i + chunk_size] for i in range(0, len(all_files), chunk_size)]
+
+
+def process_data(cur, conn, filepath, func, incremental=True, chunk_size=None, commit_policy=None,
+                 reload_changed=True):
+    """
+    Create list of all song and log JSON files, process it one by one by calling process function for each file
+    and report progress to output. In incremental mode only new and changed files are processed.
+    If chunk size is set then process function is called for the chunk of files instead of single file.
+    Files are committed according to the commit policy, by default every file (or chunk) is committed separately.
+    Changed files which were loaded before are processed again only if `reload_changed` is set.
+    """
+
+    start = time.perf_counter()
+
+    all_files = find_files(cur, filepath, incremental, reload_changed)
+    conn.commit()
+
     # get total number of files found
     num_files = len(all_files)
-    print('{} files found in {}'.format(num_files, filepath))
 
-    # iterate over files and process
-    for i, datafile in enumerate(all_files, 1):
-        func(cur, datafile)
-        conn.commit()
-        print('{}/{} files processed.'.format(i, num_files))
+    batch = TransactionBatch(cur, conn, commit_policy or CommitPolicy())
+    chunk_func = as_chunk_func(func, bool(chunk_size))
 
+    # iterate over files (or chunks of files) and process
+    num_processed = 0
+    for datafiles in split_chunks(all_files, chunk_size or 1):
+        batch.process(chunk_func, datafiles)
+        num_processed += len(datafiles)
+        print('{}/{} files processed.'.format(num_processed, num_files))
+
+    batch.commit()
+
+    return report_stats(filepath, num_files, time.perf_counter() - start)
+
+
+# Connection, cursor, process function, current transaction and flush barrier of the worker process,
+# see `init_worker`
+worker_conn = None
+worker_cur = None
+worker_func = None
+worker_batch = None
+worker_flush_barrier = None
+
+
+def init_worker(func, chunked, commit_policy, flush_barrier):
+    """Open own connection to sparkifydb in the worker process and remember the process function."""
+
+    global worker_conn, worker_cur, worker_func, worker_batch, worker_flush_barrier
+
+    worker_conn = psycopg2.connect(DSN)
+    worker_cur = worker_conn.cursor()
+    worker_func = as_chunk_func(func, chunked)
+    worker_batch = TransactionBatch(worker_cur, worker_conn, commit_policy)
+    worker_flush_barrier = flush_barrier
+
+    # close connection when the worker process exits, the last transaction is committed by `flush_worker`
+    Finalize(worker_conn, worker_conn.close, exitpriority=10)
+
+
+def process_task_in_worker(datafiles):
+    """
+    Process single file or chunk of files in the worker process.
+    Return number of processed files and metrics of the files committed by the worker so far
+    to aggregate them in the main process.
+    """
+
+    worker_batch.process(worker_func, datafiles)
+    return len(datafiles), metrics.pop()
+
+
+def flush_worker(_):
+    """
+    Commit the last transaction of the worker process and return metrics of its files.
+    The worker waits on the barrier until all workers take their flush task, so each worker takes exactly one.
+    """
+
+    try:
+        worker_batch.commit()
+    finally:
+        worker_flush_barrier.wait()
+    return 0, metrics.pop()
+
+
+def process_data_parallel(cur, conn, filepath, func, workers, incremental=True, chunk_size=None, commit_policy=None,
+                          reload_changed=True, prepare_files=None):
+    """
+    Create list of all song and log JSON files and process it with the pool of worker processes.
+
+    Each worker has its own connection to sparkifydb and processes disjoint parts of the file list
+    with the same process function as `process_data`. Progress is reported to output by the main process.
+    The function returns when all files are processed. In incremental mode only new and changed files are processed.
+    If chunk size is set then process function is called for the chunk of files instead of single file.
+    Each worker commits its files according to the commit policy. The last transaction of every worker is committed
+    by the flush task sent after all files, so its commit errors and metrics reach the main process.
+    Changed files which were loaded before are processed again only if `reload_changed` is set.
+    If `prepare_files` is set then it is called with the cursor, connection and list of files before the workers start.
+    """
+
+    start = time.perf_counter()
+
+    all_files = find_files(cur, filepath, incremental, reload_changed)
+    conn.commit()
+
+    # get total number of files found
+    num_files = len(all_files)
+    if num_files == 0:
+        return report_stats(filepath, num_files, time.perf_counter() - start)
+
+    if prepare_files is not None:
+        prepare_files(cur, conn, all_files)
+
+    tasks = split_chunks(all_files, chunk_size or 1)
+
+    # several tasks per worker are sent at once to balance files of different size between workers
+    tasks_per_send = max(1, len(tasks) // (workers * 4))
+
+    initargs = (func, bool(chunk_size), commit_policy or CommitPolicy(), multiprocessing.Barrier(workers))
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+        num_processed = 0
+        for processed, worker_metrics in pool.imap_unordered(process_task_in_worker, tasks, tasks_per_send):
+            metrics.merge(worker_metrics)
+            num_processed += processed
+            print('{}/{} files processed.'.format(num_processed, num_files))
+
+        # commit the last transaction of every worker
+        for _, worker_metrics in pool.imap_unordered(flush_worker, range(workers)):
+            metrics.merge(worker_metrics)
+
+        # let workers exit normally to close their connections
+        pool.close()
+        pool.join()
+
+    return report_stats(filepath, num_files, time.perf_counter() - start)
+
+
+# Log file processing functions available for the `--mode` option
+log_file_processors = {
+    'copy': process_log_file_copy,
+    'row': process_log_file,
+}
+
+
+def load_data(cur, conn, args):
+    """
+    Process all song files and then all log files in the mode chosen by command line arguments.
+    Return number of processed files and elapsed time for song and log files.
+    """
+
+    commit_policy = CommitPolicy(args.commit_files, args.commit_records, args.commit_seconds)
+    song_path = os.path.join(args.data_dir, 'song_data')
+    log_path = os.path.join(args.data_dir, 'log_data')
+    stats = {}
+
+    if args.mode == 'staging':
+        stats['song_data'] = process_data(cur, conn, filepath=song_path, func=process_song_files_staging,
+                                          incremental=not args.full, chunk_size=args.song_chunk_size or 1,
+                                          commit_policy=commit_policy)
+        stats['log_data'] = process_data(cur, conn, filepath=log_path, func=process_log_files_staging,
+                                         incremental=not args.full, chunk_size=args.log_files_per_chunk,
+                                         commit_policy=commit_policy, reload_changed=False)
+        return stats
+
+    song_lookup = SongLookup() if args.lookup == 'memory' else None
+    song_func = process_song_files if args.song_chunk_size else process_song_file
+    song_chunk_size = args.song_chunk_size or None
+    log_func = functools.partial(log_file_processors[args.mode], chunksize=args.log_chunk_size)
+
+    if args.workers > 1:
+        # song files are processed by the workers, so the lookup index is loaded after all of them are in sparkifydb
+        stats['song_data'] = process_data_parallel(cur, conn, filepath=song_path, func=song_func,
+                                                   workers=args.workers, incremental=not args.full,
+                                                   chunk_size=song_chunk_size, commit_policy=commit_policy)
+
+        if song_lookup is not None:
+            song_lookup.load(cur)
+
+        stats['log_data'] = process_data_parallel(cur, conn, filepath=log_path,
+                                                  func=functools.partial(log_func, song_lookup=song_lookup),
+                                                  workers=args.workers, incremental=not args.full,
+                                                  commit_policy=commit_policy, reload_changed=False,
+                                                  prepare_files=create_songplay_partitions)
+    else:
+        # preload songs from the previous runs, new songs are added while song files are processed
+        if song_lookup is not None:
+            song_lookup.load(cur)
+
+        stats['song_data'] = process_data(cur, conn, filepath=song_path,
+                                          func=functools.partial(song_func, song_lookup=song_lookup),
+                                          incremental=not args.full, chunk_size=song_chunk_size,
+                                          commit_policy=commit_policy)
+        stats['log_data'] = process_data(cur, conn, filepath=log_path,
+                                         func=functools.partial(log_func, song_lookup=song_lookup),
+                                         incremental=not args.full, commit_policy=commit_policy,
+                                         reload_changed=False)
+
+    return stats
+
+
+def drop_songplay_indexes(cur, conn):
+    """Drop secondary indexes of songplays table before the bulk load."""
+
+    for query in songplay_index_drop_queries:
+        cur.execute(query)
+    conn.commit()
 
-def main():
-    """Connect to database server and call process_data function to process all JSON files."""
 
-    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+def create_songplay_indexes(cur, conn):
+    """Create secondary indexes of songplays table if they do not exist, for example after the bulk load."""
+
+    for query in songplay_index_queries:
+        cur.execute(query)
+    conn.commit()
+
+
+def positive_int(value):
+    """Parse command line argument which has to be a positive integer."""
+
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('{} is not a positive integer'.format(value))
+    return number
+
+
+def add_common_arguments(parser):
+    """Add command line arguments which are shared by all entry points of the ETL pipeline."""
+
+    parser.add_argument('--lookup', choices=('memory', 'query'), default='memory',
+                        help='how to find songs for songplays: in-memory index or query per event')
+    parser.add_argument('--full', action='store_true',
+                        help='process all files, not only new or changed since the last run')
+    parser.add_argument('--bulk', action='store_true',
+                        help='drop secondary indexes of songplays table during the load and rebuild them afterwards')
+    parser.add_argument('--song-chunk-size', type=int, default=1000,
+                        help='number of song files loaded with single multi-row upsert, 0 to load files one by one')
+    parser.add_argument('--log-chunk-size', type=int, default=None,
+                        help='number of lines of the log file read and loaded at once, by default the whole file')
+    parser.add_argument('--data-dir', default='data',
+                        help='directory with song_data and log_data subdirectories')
+    parser.add_argument('--commit-files', type=int, default=1,
+                        help='commit the transaction after given number of files')
+    parser.add_argument('--commit-records', type=int, default=None,
+                        help='commit the transaction after given number of records')
+    parser.add_argument('--commit-seconds', type=float, default=None,
+                        help='commit the transaction after given number of seconds')
+    parser.add_argument('--metrics-file', default=None,
+                        help='save elapsed time and number of records of every file and stage timers '
+                             'to the file in JSON lines format')
+    parser.add_argument('--profile', default=None,
+                        help='save cProfile statistics of the main process to the file, '
+                             'worker processes of the parallel load are not profiled')
+
+
+def build_parser():
+    """Return parser of the command line arguments of the ETL pipeline."""
+
+    parser = argparse.ArgumentParser(description='Load Sparkify song and log JSON files to sparkifydb.')
+    parser.add_argument('--mode', choices=[*log_file_processors.keys(), 'staging'], default='copy',
+                        help='how to load log files: COPY through temporary tables, row by row INSERTs '
+                             'or COPY raw song and log files to the staging tables and merge them with SQL')
+    parser.add_argument('--workers', type=positive_int, default=1,
+                        help='number of worker processes, each worker uses its own database connection')
+    parser.add_argument('--log-files-per-chunk', type=positive_int, default=10,
+                        help='number of log files copied to the staging table before the merge in staging mode')
+    add_common_arguments(parser)
+    return parser
+
+
+def run(args, load_func=load_data):
+    """
+    Connect to database server and process all JSON files with the load function, return statistics of the load.
+    By default files are loaded by `load_data`.
+    """
+
+    metrics.reset()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    conn = psycopg2.connect(DSN)
     cur = conn.cursor()
 
-    process_data(cur, conn, filepath='data/song_data', func=process_song_file)
-    process_data(cur, conn, filepath='data/log_data', func=process_log_file)
+    if args.bulk:
+        drop_songplay_indexes(cur, conn)
+
+    stats = load_func(cur, conn, args)
+
+    # indexes are rebuilt after the bulk load, and also restored if the previous bulk load was interrupted
+    start = time.perf_counter()
+    create_songplay_indexes(cur, conn)
+    stats['indexes'] = {'seconds': time.perf_counter() - start}
 
     conn.close()
 
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    metrics.report()
+    if args.metrics_file:
+        metrics.save(args.metrics_file)
+
+    stats['metrics'] = metrics.summary()
+    return stats
+
+
+def main():
+    """Parse command line arguments and run the ETL pipeline."""
+
+    parser = build_parser()
+    args = parser.parse_args()
+
+    # staging tables are shared, so concurrent merges would block each other on TRUNCATE
+    if args.mode == 'staging' and args.workers > 1:
+        parser.error('staging mode can not be used with several workers')
+
+    run(args)
+
 
 if __name__ == "__main__":
     main()
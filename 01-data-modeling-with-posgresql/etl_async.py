@@ -0,0 +1,308 @@
+import os
+import time
+import asyncio
+import argparse
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+import etl
+from etl import DSN, find_files, report_stats, split_chunks
+from song_lookup import SongLookup
+from commit_policy import CommitPolicy, TransactionBatch, on_commit
+from metrics import metrics
+from partitions import create_songplay_partitions
+
+# Loaders of the parsed log DataFrames available for the `--mode` option
+log_df_loaders = {
+    'copy': etl.copy_log_df,
+    'row': etl.insert_log_df,
+}
+
+
+class PooledConnection:
+    """
+    Connection to sparkifydb which is used from asyncio code.
+
+    psycopg2 is blocking, so all statements of the connection are run in its own single thread executor
+    while the event loop keeps parsing files. The connection is always used by the same thread,
+    so per-thread caches like created partitions stay consistent with its transactions.
+    Partitions of the `songplays` table are created before the load, so connections of the pool do not run DDL.
+    Processed files are committed according to the commit policy.
+    """
+
+    def __init__(self, commit_policy):
+        self.conn = psycopg2.connect(DSN)
+        self.batch = TransactionBatch(self.conn.cursor(), self.conn, commit_policy)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def run(self, func, *args):
+        """Run blocking function in the executor of the connection."""
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def process(self, func, datafiles):
+        """Process chunk of files in the current transaction of the connection."""
+
+        await self.run(self.batch.process, func, datafiles)
+
+    async def commit(self):
+        """Commit the current transaction of the connection."""
+
+        await self.run(self.batch.commit)
+
+    async def close(self):
+        """Commit the current transaction and close the connection."""
+
+        await self.commit()
+        await self.run(self.conn.close)
+        self.executor.shutdown()
+
+
+class ConnectionPool:
+    """Bounded pool of connections to sparkifydb, a coroutine waits in `acquire` while all connections are busy."""
+
+    def __init__(self, size, commit_policy):
+        self.connections = [PooledConnection(commit_policy) for _ in range(size)]
+        self.free = asyncio.Queue()
+        for connection in self.connections:
+            self.free.put_nowait(connection)
+
+    @property
+    def size(self):
+        return len(self.connections)
+
+    async def acquire(self):
+        """Wait for the free connection and return it."""
+
+        return await self.free.get()
+
+    def release(self, connection):
+        """Return the connection to the pool."""
+
+        self.free.put_nowait(connection)
+
+    async def commit(self):
+        """Commit current transactions of all connections."""
+
+        await asyncio.gather(*[connection.commit() for connection in self.connections])
+
+    async def close(self):
+        """Commit current transactions and close all connections."""
+
+        await asyncio.gather(*[connection.close() for connection in self.connections])
+
+
+def parse_song_chunk(datafiles):
+    """Parse chunk of song files, return song and artist rows."""
+
+    return etl.parse_song_files(datafiles)
+
+
+def load_song_chunk(cur, rows):
+    """Insert parsed song and artist rows, return number of loaded songs."""
+
+    song_rows, artist_rows = rows
+    etl.insert_song_rows(cur, song_rows, artist_rows)
+    return len(song_rows)
+
+
+def parse_log_chunk(datafiles, chunksize=None):
+    """Parse chunk of log files, return list of DataFrames with NextSong events."""
+
+    return [df for filepath in datafiles for df in etl.read_log_chunks(filepath, chunksize)]
+
+
+def load_log_chunk(cur, dfs, load_df, song_lookup=None):
+    """Load parsed NextSong events with the DataFrame loader, return number of loaded events."""
+
+    for df in dfs:
+        load_df(cur, df, song_lookup)
+    return sum(len(df) for df in dfs)
+
+
+def parse_collected(parse, datafiles):
+    """
+    Parse chunk of files in the parse thread, return parsed data and the counters collected during the parsing.
+    Counters are not added to the metrics here, the loader adds them when the chunk is committed.
+    """
+
+    with metrics.collect() as counters:
+        data = parse(datafiles)
+    return data, counters
+
+
+def as_load_func(load, data, counters):
+    """
+    Return process function for `TransactionBatch` which loads already parsed data.
+    Parse error is raised inside the savepoint, so the file is recorded as failed the same way as load errors.
+    Parse counters of the chunk are added to the metrics only if the chunk is committed.
+    """
+
+    def process(cur, datafiles):
+        if isinstance(data, Exception):
+            raise data
+        on_commit(functools.partial(metrics.add_counters, counters))
+        return load(cur, data)
+
+    return process
+
+
+async def process_data_async(cur, conn, filepath, parse, load, pool, parse_workers, queue_size, incremental=True,
+                             chunk_size=None, reload_changed=True, prepare_files=None):
+    """
+    Create list of all song or log JSON files and process them with overlapped parsing and loading.
+
+    Files are parsed by `parse_workers` threads and parsed data is passed to the load queue, where it is taken by
+    the loaders, one per pool connection. Load queue holds at most `queue_size` parsed chunks, so parsing waits
+    while the database is behind and memory usage stays bounded. In incremental mode only new and changed files
+    are processed. If chunk size is set then parse and load functions are called for the chunk of files.
+    All connections are committed when the files are processed. If any parser or loader fails, the others are
+    cancelled and the error is raised.
+    Changed files which were loaded before are processed again only if `reload_changed` is set.
+    If `prepare_files` is set then it is called with the cursor, connection and list of files before the load.
+    """
+
+    start = time.perf_counter()
+
+    all_files = find_files(cur, filepath, incremental, reload_changed)
+    conn.commit()
+
+    if prepare_files is not None and all_files:
+        prepare_files(cur, conn, all_files)
+
+    # get total number of files found
+    num_files = len(all_files)
+    num_processed = 0
+
+    loop = asyncio.get_running_loop()
+    parse_queue = asyncio.Queue()
+    for datafiles in split_chunks(all_files, chunk_size or 1):
+        parse_queue.put_nowait(datafiles)
+    load_queue = asyncio.Queue(maxsize=queue_size)
+
+    async def parser(executor):
+        while not parse_queue.empty():
+            datafiles = parse_queue.get_nowait()
+            try:
+                data, counters = await loop.run_in_executor(executor, parse_collected, parse, datafiles)
+            except Exception as e:
+                data, counters = e, {}
+
+            # waits here while the load queue is full
+            await load_queue.put((datafiles, data, counters))
+
+    async def loader():
+        nonlocal num_processed
+
+        while True:
+            item = await load_queue.get()
+            if item is None:
+                return
+
+            datafiles, data, counters = item
+            connection = await pool.acquire()
+            try:
+                await connection.process(as_load_func(load, data, counters), datafiles)
+            finally:
+                pool.release(connection)
+
+            num_processed += len(datafiles)
+            print('{}/{} files processed.'.format(num_processed, num_files))
+
+    async def parse_all(executor):
+        await asyncio.gather(*[parser(executor) for _ in range(parse_workers)])
+
+        # all files are parsed, stop the loaders when the load queue is drained
+        for _ in range(pool.size):
+            await load_queue.put(None)
+
+    with ThreadPoolExecutor(max_workers=parse_workers) as executor:
+        tasks = [asyncio.ensure_future(parse_all(executor))]
+        tasks.extend(asyncio.ensure_future(loader()) for _ in range(pool.size))
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # failed loader stops taking parsed chunks, so parsers and other loaders are cancelled
+            # instead of waiting on the full load queue forever
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    await pool.commit()
+
+    return report_stats(filepath, num_files, time.perf_counter() - start)
+
+
+async def load_data_async(cur, conn, args):
+    """
+    Process all song files and then all log files with overlapped parsing and loading.
+    Return number of processed files and elapsed time for song and log files.
+    """
+
+    commit_policy = CommitPolicy(args.commit_files, args.commit_records, args.commit_seconds)
+    pool = ConnectionPool(args.connections, commit_policy)
+    queue_size = args.queue_size or 2 * args.connections
+    song_path = os.path.join(args.data_dir, 'song_data')
+    log_path = os.path.join(args.data_dir, 'log_data')
+    stats = {}
+
+    try:
+        stats['song_data'] = await process_data_async(cur, conn, filepath=song_path, parse=parse_song_chunk,
+                                                      load=load_song_chunk, pool=pool,
+                                                      parse_workers=args.parse_workers, queue_size=queue_size,
+                                                      incremental=not args.full,
+                                                      chunk_size=args.song_chunk_size or 1)
+
+        # song files are committed by the pool, so the lookup index is loaded after all of them are in sparkifydb
+        song_lookup = None
+        if args.lookup == 'memory':
+            song_lookup = SongLookup()
+            song_lookup.load(cur)
+            conn.commit()
+
+        parse = functools.partial(parse_log_chunk, chunksize=args.log_chunk_size)
+        load = functools.partial(load_log_chunk, load_df=log_df_loaders[args.mode], song_lookup=song_lookup)
+        stats['log_data'] = await process_data_async(cur, conn, filepath=log_path, parse=parse, load=load, pool=pool,
+                                                     parse_workers=args.parse_workers, queue_size=queue_size,
+                                                     incremental=not args.full, reload_changed=False,
+                                                     prepare_files=create_songplay_partitions)
+    finally:
+        await pool.close()
+
+    return stats
+
+
+def load_data(cur, conn, args):
+    """Run the asyncio load of all song and log files, it is used as the load function of `etl.run`."""
+
+    return asyncio.run(load_data_async(cur, conn, args))
+
+
+def build_parser():
+    """Return parser of the command line arguments of the asyncio ETL pipeline."""
+
+    parser = argparse.ArgumentParser(
+        description='Load Sparkify song and log JSON files to sparkifydb with overlapped parsing and loading.')
+    parser.add_argument('--mode', choices=log_df_loaders.keys(), default='copy',
+                        help='how to load log files: COPY through temporary tables or row by row INSERTs')
+    parser.add_argument('--connections', type=etl.positive_int, default=4,
+                        help='size of the database connection pool, each connection loads one chunk at a time')
+    parser.add_argument('--parse-workers', type=etl.positive_int, default=2,
+                        help='number of threads which read and parse files')
+    parser.add_argument('--queue-size', type=etl.positive_int, default=None,
+                        help='maximum number of parsed chunks waiting for the load, twice the pool size by default')
+    etl.add_common_arguments(parser)
+    return parser
+
+
+def main():
+    """Parse command line arguments and run the asyncio ETL pipeline."""
+
+    args = build_parser().parse_args()
+    etl.run(args, load_func=load_data)
+
+
+if __name__ == "__main__":
+    main()
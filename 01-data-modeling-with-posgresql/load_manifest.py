@@ -0,0 +1,85 @@
+import os
+import hashlib
+from datetime import datetime
+from sql_queries import load_manifest_select, load_manifest_upsert
+
+LOADED = 'loaded'
+FAILED = 'failed'
+
+# Hashes computed by this process keyed by file path, size and modification time, so the file which is hashed
+# while new files are selected is not hashed again when it is recorded after the load.
+# Worker processes inherit the hashes computed by the main process before the pool is started.
+file_hashes = {}
+
+
+def get_file_hash(filepath):
+    """Return MD5 hash of the file content, the hash is computed once for the same size and modification time."""
+
+    key = (filepath, *get_file_stat(filepath))
+    if key not in file_hashes:
+        md5 = hashlib.md5()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(chunk)
+        file_hashes[key] = md5.hexdigest()
+    return file_hashes[key]
+
+
+def get_file_stat(filepath):
+    """Return size and modification time of the file."""
+
+    stat = os.stat(filepath)
+    return stat.st_size, datetime.fromtimestamp(stat.st_mtime)
+
+
+def select_new_files(cur, all_files, reload_changed=True):
+    """
+    Return files which are not loaded yet according to the load manifest.
+
+    File is skipped if it was successfully loaded before and its size and modification time are the same.
+    If only modification time is changed then content hash is checked, so touched files are not reloaded.
+    Failed files and files which were not committed because of the crash are returned again.
+
+    Loaded files with changed content are returned only if `reload_changed` is set. Otherwise they are reported
+    and skipped: it is used for log files, because rows of the previous load can not be replaced by the new ones.
+    """
+
+    cur.execute(load_manifest_select)
+    manifest = {file_path: (file_size, file_mtime, file_hash, status)
+                for file_path, file_size, file_mtime, file_hash, status in cur}
+
+    new_files = []
+    changed_files = []
+    for filepath in all_files:
+        if filepath not in manifest:
+            new_files.append(filepath)
+            continue
+
+        file_size, file_mtime, file_hash, status = manifest[filepath]
+        size, mtime = get_file_stat(filepath)
+
+        if status != LOADED:
+            new_files.append(filepath)
+        elif size != file_size or (mtime != file_mtime and get_file_hash(filepath) != file_hash):
+            if reload_changed:
+                new_files.append(filepath)
+            else:
+                changed_files.append(filepath)
+        elif mtime != file_mtime:
+            # same content, just remember new modification time to avoid hashing next time
+            record_file(cur, filepath, LOADED)
+
+    if changed_files:
+        print('{} loaded files are changed and skipped, their rows can not be replaced, load them manually:'
+              .format(len(changed_files)))
+        for filepath in changed_files:
+            print('    {}'.format(filepath))
+
+    return new_files
+
+
+def record_file(cur, filepath, status):
+    """Save file path, size, modification time, content hash and load status to the load manifest."""
+
+    size, mtime = get_file_stat(filepath)
+    cur.execute(load_manifest_upsert, (filepath, size, mtime, get_file_hash(filepath), status))
@@ -0,0 +1,133 @@
+import json
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Timers and counters of the ETL pipeline stages.
+
+    Timers accumulate elapsed seconds of the stages (JSON parsing, NextSong filtering, inserts to each table, commits),
+    counters accumulate number of processed records and loaded rows. Besides that every processed file (or chunk
+    of files) is recorded with its number of records and elapsed time to find slow files.
+    Worker processes have their own metrics which are sent to the main process with `pop` and `merge`.
+    Metrics can be updated from several threads, timers of concurrent stages are summed up.
+    Counters can be collected separately per thread with `collect`, for example to add them only after the commit.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """Reset all timers, counters and recorded files."""
+
+        self.timers = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.files = []
+
+    @contextmanager
+    def timer(self, name):
+        """Measure elapsed time of the code block and add it to the timer with given name."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        """Add elapsed seconds to the timer with given name."""
+
+        with self.lock:
+            self.timers[name] += seconds
+
+    def count(self, name, value=1):
+        """Add value to the counter with given name, or to the collected counters of the current thread."""
+
+        collected = getattr(self.local, 'collected', None)
+        if collected is not None:
+            collected[name] += value
+            return
+
+        with self.lock:
+            self.counters[name] += value
+
+    @contextmanager
+    def collect(self):
+        """
+        Collect counters of the code block run by the current thread to the dictionary which is yielded,
+        instead of adding them to the metrics. Collected counters can be added later with `add_counters`.
+        """
+
+        previous = getattr(self.local, 'collected', None)
+        self.local.collected = collected = defaultdict(int)
+        try:
+            yield collected
+        finally:
+            self.local.collected = previous
+
+    def add_counters(self, counters):
+        """Add values of the counters collected by `collect`."""
+
+        with self.lock:
+            for name, value in counters.items():
+                self.counters[name] += value
+
+    def record_files(self, datafiles, records, seconds):
+        """Record number of records and elapsed time of the processed file or chunk of files."""
+
+        with self.lock:
+            self.files.append({
+                'files': datafiles,
+                'records': records,
+                'seconds': seconds,
+                'records_per_second': records / seconds if seconds else 0,
+            })
+
+    def pop(self):
+        """Return all collected metrics as a dictionary and reset them."""
+
+        snapshot = {'timers': dict(self.timers), 'counters': dict(self.counters), 'files': self.files}
+        self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add metrics collected by another process."""
+
+        for name, seconds in snapshot['timers'].items():
+            self.timers[name] += seconds
+        for name, value in snapshot['counters'].items():
+            self.counters[name] += value
+        self.files.extend(snapshot['files'])
+
+    def summary(self):
+        """Return timers and counters as a dictionary."""
+
+        return {'timers': dict(self.timers), 'counters': dict(self.counters)}
+
+    def report(self):
+        """Print timers sorted by elapsed time and counters to output."""
+
+        print('Stage timers:')
+        for name, seconds in sorted(self.timers.items(), key=lambda item: item[1], reverse=True):
+            print('    {:<20} {:>10.3f} s'.format(name, seconds))
+
+        print('Counters:')
+        for name, value in sorted(self.counters.items()):
+            print('    {:<20} {:>10}'.format(name, value))
+
+    def save(self, filepath):
+        """Save every recorded file and the summary to the file in JSON lines format."""
+
+        with open(filepath, 'w', encoding='utf8') as f:
+            for record in self.files:
+                f.write(json.dumps({'type': 'file', **record}) + '\n')
+            f.write(json.dumps({'type': 'summary', **self.summary()}) + '\n')
+
+
+# Metrics of the current process
+metrics = Metrics()
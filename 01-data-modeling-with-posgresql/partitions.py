@@ -0,0 +1,90 @@
+import re
+import threading
+from datetime import datetime
+from sql_queries import songplay_partitioned_select, songplay_partition_create
+
+# Whether `songplays` table is partitioned and which partitions are already created by the current thread.
+# It allows to avoid DDL statements for every processed file. Partitions are tracked per thread because
+# each thread uses its own connection and does not see partitions created in uncommitted transactions of others.
+songplays_partitioned = None
+local = threading.local()
+
+# Partitions created and committed by the main process before the concurrent load. They are known to all threads
+# and to the worker processes started afterwards, so concurrent connections do not run DDL on `songplays`.
+committed_partitions = set()
+
+# `ts` field of the log record, it is found without parsing the whole record
+TS_PATTERN = re.compile(rb'"ts"\s*:\s*(\d+)')
+
+
+def get_known_partitions():
+    """Return set of (year, month) pairs of the partitions created by the current thread."""
+
+    if not hasattr(local, 'known_partitions'):
+        local.known_partitions = set()
+    return local.known_partitions
+
+
+def is_songplays_partitioned(cur):
+    """Return True if `songplays` table is partitioned, the result is cached for the process."""
+
+    global songplays_partitioned
+
+    if songplays_partitioned is None:
+        cur.execute(songplay_partitioned_select)
+        songplays_partitioned = cur.fetchone()[0]
+    return songplays_partitioned
+
+
+def ensure_songplay_partitions(cur, months):
+    """
+    Create monthly partitions of the `songplays` table for the given (year, month) pairs if they do not exist.
+    Nothing is done if `songplays` table is not partitioned.
+    """
+
+    if not is_songplays_partitioned(cur):
+        return
+
+    known_partitions = get_known_partitions()
+    for year, month in sorted(set(months) - committed_partitions - known_partitions):
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        cur.execute(songplay_partition_create.format(
+            name='songplays_y{}m{:02d}'.format(year, month),
+            start='{}-{:02d}-01'.format(year, month),
+            end='{}-{:02d}-01'.format(next_year, next_month)))
+        known_partitions.add((year, month))
+
+
+def get_file_months(filepath):
+    """Return set of (year, month) pairs of all events of the log file."""
+
+    with open(filepath, 'rb') as f:
+        timestamps = {int(ts) // 1000 for ts in TS_PATTERN.findall(f.read())}
+    return {(t.year, t.month) for t in map(datetime.utcfromtimestamp, timestamps)}
+
+
+def create_songplay_partitions(cur, conn, filepaths):
+    """
+    Create and commit partitions of the `songplays` table for all months of the log files before they are loaded
+    by concurrent connections. `CREATE TABLE ... PARTITION OF` locks the whole `songplays` table until
+    the transaction is committed, so creating the same partition from the concurrent transactions blocks them
+    or fails. Months of all events are used, so a partition may stay empty if the month has no NextSong events.
+    """
+
+    if not is_songplays_partitioned(cur):
+        return
+
+    months = set()
+    for filepath in filepaths:
+        months |= get_file_months(filepath)
+
+    ensure_songplay_partitions(cur, months)
+    conn.commit()
+    committed_partitions.update(months)
+    print('{} partitions of songplays table are ready.'.format(len(months)))
+
+
+def forget_partitions():
+    """Forget created partitions after the rollback because their creation could be rolled back too."""
+
+    get_known_partitions().clear()
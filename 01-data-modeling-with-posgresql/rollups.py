@@ -0,0 +1,51 @@
+import time
+import argparse
+import psycopg2
+from sql_queries import rollup_refresh_queries
+
+ROLLUP_TABLES = ('plays_per_hour', 'user_daily_plays', 'song_daily_plays', 'artist_daily_plays', 'level_daily_plays')
+
+
+def refresh_rollups(cur, conn):
+    """
+    Rebuild all rollup tables from the `songplays` fact table in a single transaction.
+    Dashboard queries see either old or new rollups, never empty ones.
+    """
+
+    for query in rollup_refresh_queries:
+        cur.execute(query)
+    conn.commit()
+
+
+def count_rollup_rows(cur):
+    """Return number of rows in every rollup table."""
+
+    counts = {}
+    for table in ROLLUP_TABLES:
+        cur.execute('SELECT COUNT(*) FROM {};'.format(table))
+        counts[table] = cur.fetchone()[0]
+
+    return counts
+
+
+def main():
+    """Refresh rollup tables of sparkifydb, for example after songplays were changed outside of the ETL pipeline."""
+
+    parser = argparse.ArgumentParser(description='Rebuild rollup tables of sparkifydb from the songplays table.')
+    parser.parse_args()
+
+    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+    cur = conn.cursor()
+
+    start = time.perf_counter()
+    refresh_rollups(cur, conn)
+    print('Rollup tables are refreshed in {:.2f} seconds.'.format(time.perf_counter() - start))
+
+    for table, count in count_rollup_rows(cur).items():
+        print('    {:<20} {:>10} rows'.format(table, count))
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+from decimal import Decimal
+from sql_queries import song_lookup_select
+
+
+class SongLookup:
+    """
+    In-memory index of songs keyed by (title, artist name, duration).
+
+    It replaces `song_select` query for every NextSong event: the index is preloaded once from songs and artists
+    tables and kept up to date while song files are processed, so each songplay is resolved with a dictionary probe.
+    Same as `song_select` the first found song wins if several songs share the same key.
+    """
+
+    def __init__(self):
+        self._index = {}
+
+    def __len__(self):
+        return len(self._index)
+
+    @staticmethod
+    def _key(title, artist_name, duration):
+        # durations are compared as decimal numbers the same way as `s.duration = e.length` in SQL:
+        # numeric duration is returned from the database as Decimal while files are parsed to floats,
+        # both are converted through their shortest decimal text, missing (None or NaN) durations are None
+        if duration is None or duration != duration:
+            return title, artist_name, None
+        return title, artist_name, Decimal(str(duration))
+
+    def load(self, cur):
+        """Preload all songs which are already stored in sparkifydb."""
+
+        cur.execute(song_lookup_select)
+        for title, artist_name, duration, song_id, artist_id in cur:
+            self.add(title, artist_name, duration, song_id, artist_id)
+
+    def add(self, title, artist_name, duration, song_id, artist_id):
+        """Register upserted song in the index, songs without duration are never matched by SQL join, so skipped."""
+
+        key = self._key(title, artist_name, duration)
+        if key[2] is not None:
+            self._index.setdefault(key, (song_id, artist_id))
+
+    def add_songs(self, songs):
+        """Register upserted songs given as (title, artist name, duration, song_id, artist_id) tuples."""
+
+        for song in songs:
+            self.add(*song)
+
+    def get(self, title, artist_name, duration):
+        """Return (song_id, artist_id) pair for the song or (None, None) if song is unknown."""
+
+        return self._index.get(self._key(title, artist_name, duration), (None, None))
+
+    def resolve(self, df):
+        """Return lists of song_id and artist_id for all events in the DataFrame."""
+
+        found = [self.get(*key) for key in zip(df['song'], df['artist'], df['length'])]
+        song_ids = [song_id for song_id, _ in found]
+        artist_ids = [artist_id for _, artist_id in found]
+        return song_ids, artist_ids
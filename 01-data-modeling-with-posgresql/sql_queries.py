@@ -5,6 +5,11 @@ user_table_drop = "DROP TABLE IF EXISTS users;"
 song_table_drop = "DROP TABLE IF EXISTS songs;"
 artist_table_drop = "DROP TABLE IF EXISTS artists;"
 time_table_drop = "DROP TABLE IF EXISTS time;"
+load_manifest_table_drop = "DROP TABLE IF EXISTS load_manifest;"
+staging_events_table_drop = "DROP TABLE IF EXISTS stg_events;"
+staging_songs_table_drop = "DROP TABLE IF EXISTS stg_songs;"
+rollup_table_drop = ("DROP TABLE IF EXISTS plays_per_hour, user_daily_plays, song_daily_plays, artist_daily_plays, "
+                     "level_daily_plays;")
 
 # CREATE TABLES
 
@@ -22,6 +27,24 @@ songplay_table_create = ("""
     );  
 """)
 
+# Partitioned version of the `songplays` table. Each month is stored in its own partition which is created
+# by the ETL pipeline when the first event of the month arrives. Primary key of the partitioned table
+# has to include the partition key.
+songplay_partitioned_table_create = ("""
+    CREATE TABLE songplays(
+        songplay_id bigserial,
+        start_time timestamp NOT NULL,
+        user_id int,
+        level varchar(100),
+        song_id char(18),
+        artist_id char(18),
+        session_id int,
+        location text,
+        user_agent text,
+        PRIMARY KEY (songplay_id, start_time)
+    ) PARTITION BY RANGE (start_time);
+""")
+
 user_table_create = ("""
     CREATE TABLE users(
         user_id int PRIMARY KEY,
@@ -64,6 +87,149 @@ time_table_create = ("""
     );
 """)
 
+# Load manifest keeps track of the processed files, thus ETL pipeline is able to skip already loaded files.
+# `txid` is the transaction which committed the file, several files can be committed by the same transaction.
+load_manifest_table_create = ("""
+    CREATE TABLE load_manifest(
+        file_path text PRIMARY KEY,
+        file_size bigint NOT NULL,
+        file_mtime timestamp NOT NULL,
+        file_hash char(32) NOT NULL,
+        status varchar(10) NOT NULL,
+        loaded_at timestamp NOT NULL DEFAULT now(),
+        txid bigint NOT NULL DEFAULT txid_current()
+    );
+""")
+
+# Staging tables contain raw data from the JSON files as is. They are UNLOGGED because the data is merged
+# to the star schema tables in the same transaction and there is nothing to recover from them after a crash.
+staging_events_table_create = ("""
+    CREATE UNLOGGED TABLE stg_events(
+        artist text,
+        auth varchar(100),
+        firstName varchar(100),
+        gender char(1),
+        itemInSession int,
+        lastName varchar(100),
+        length numeric,
+        level varchar(100),
+        location text,
+        method varchar(10),
+        page varchar(100),
+        registration numeric,
+        sessionId int,
+        song text,
+        status int,
+        ts bigint,
+        userAgent text,
+        userId int
+    );
+""")
+
+staging_songs_table_create = ("""
+    CREATE UNLOGGED TABLE stg_songs(
+        num_songs int,
+        artist_id char(18),
+        artist_latitude numeric,
+        artist_longitude numeric,
+        artist_location text,
+        artist_name text,
+        song_id char(18),
+        title text,
+        duration numeric,
+        year int
+    );
+""")
+
+# ROLLUP TABLES
+# Pre-aggregated songplays for the dashboard. They are updated by the ETL pipeline in the same transaction
+# as songplays, so the dashboard reads small rollups instead of scanning the fact table.
+
+plays_per_hour_table_create = ("""
+    CREATE TABLE plays_per_hour(
+        hour timestamp PRIMARY KEY,
+        play_count bigint NOT NULL
+    );
+""")
+
+user_daily_plays_table_create = ("""
+    CREATE TABLE user_daily_plays(
+        day date,
+        user_id int,
+        play_count bigint NOT NULL,
+        PRIMARY KEY (day, user_id)
+    );
+""")
+
+song_daily_plays_table_create = ("""
+    CREATE TABLE song_daily_plays(
+        day date,
+        song_id char(18),
+        play_count bigint NOT NULL,
+        PRIMARY KEY (day, song_id)
+    );
+""")
+
+artist_daily_plays_table_create = ("""
+    CREATE TABLE artist_daily_plays(
+        day date,
+        artist_id char(18),
+        play_count bigint NOT NULL,
+        PRIMARY KEY (day, artist_id)
+    );
+""")
+
+level_daily_plays_table_create = ("""
+    CREATE TABLE level_daily_plays(
+        day date,
+        level varchar(100),
+        play_count bigint NOT NULL,
+        PRIMARY KEY (day, level)
+    );
+""")
+
+# Songs are searched by title, artist name and duration during the songplays loading. PostgreSQL hash indexes
+# support only single column, so the most selective one is indexed and the rest are checked on the found rows.
+song_title_index_create = "CREATE INDEX songs_title_idx ON songs USING hash (title);"
+
+# SONGPLAYS INDEXES
+# Dashboard queries filter songplays by time and user. Events arrive ordered by time, so small BRIN index
+# is enough for `start_time`. Secondary indexes are dropped and rebuilt by the ETL pipeline in the bulk mode.
+
+songplay_start_time_index_create = ("""
+    CREATE INDEX IF NOT EXISTS songplays_start_time_idx ON songplays USING brin (start_time);
+""")
+songplay_user_id_index_create = "CREATE INDEX IF NOT EXISTS songplays_user_id_idx ON songplays (user_id);"
+songplay_song_id_index_create = "CREATE INDEX IF NOT EXISTS songplays_song_id_idx ON songplays (song_id);"
+
+songplay_start_time_index_drop = "DROP INDEX IF EXISTS songplays_start_time_idx;"
+songplay_user_id_index_drop = "DROP INDEX IF EXISTS songplays_user_id_idx;"
+songplay_song_id_index_drop = "DROP INDEX IF EXISTS songplays_song_id_idx;"
+
+# SONGPLAYS PARTITIONS
+
+songplay_partitioned_select = ("""
+    SELECT EXISTS (
+        SELECT 1
+        FROM pg_partitioned_table
+        WHERE partrelid = 'songplays'::regclass
+    );
+""")
+
+songplay_partition_create = ("""
+    CREATE TABLE IF NOT EXISTS {name} PARTITION OF songplays
+    FOR VALUES FROM ('{start}') TO ('{end}');
+""")
+
+staging_events_months_select = ("""
+    SELECT DISTINCT EXTRACT(year FROM start_time)::int, EXTRACT(month FROM start_time)::int
+    FROM (
+        SELECT TIMESTAMP 'epoch' + ts * INTERVAL '1 millisecond' AS start_time
+        FROM stg_events
+        WHERE page = 'NextSong'
+    ) e;
+""")
+
 # INSERT RECORDS
 
 songplay_table_insert = ("""
@@ -73,46 +239,60 @@ songplay_table_insert = ("""
 
 # In case of several attempts to insert data to the users table, they should be considered as an update operation.
 # The user can change name and even gender, and what is most important for our business - he or she can switch from
-# free level to paid level and vice versa.
-user_table_insert = ("""
-    INSERT INTO users(user_id, first_name, last_name, gender, level)
-    VALUES (%s, %s, %s, %s, %s)
+# free level to paid level and vice versa. Unchanged users are not updated to avoid dead tuples in the users table.
+user_table_conflict = ("""
     ON CONFLICT (user_id) DO UPDATE
     SET first_name = excluded.first_name
         , last_name = excluded.last_name
         , gender = excluded.gender
-        , level = excluded.level;
+        , level = excluded.level
+    WHERE (users.first_name, users.last_name, users.gender, users.level)
+        IS DISTINCT FROM (excluded.first_name, excluded.last_name, excluded.gender, excluded.level);
 """)
 
+user_table_insert = ("""
+    INSERT INTO users(user_id, first_name, last_name, gender, level)
+    VALUES (%s, %s, %s, %s, %s)
+""") + user_table_conflict
+
 # The information about song maybe incomplete on the first insert. We want to update missing fields
 # if we could find information about current  song from more sources.
-song_table_insert = ("""
-    INSERT INTO songs(song_id, title, artist_id, year, duration)
-    VALUES (%s, %s, %s, %s, %s)
-     ON CONFLICT (song_id) DO UPDATE
-     SET artist_id = COALESCE(excluded.artist_id, songs.artist_id)
+song_table_conflict = ("""
+    ON CONFLICT (song_id) DO UPDATE
+    SET artist_id = COALESCE(excluded.artist_id, songs.artist_id)
         , year = COALESCE(excluded.year, songs.year)
         , duration = COALESCE(excluded.duration, songs.duration);
 """)
 
-# Same as with songs we want to update missing information
-artist_table_insert = ("""
-    INSERT INTO artists(artist_id, name, location, latitude, longitude)
+song_table_insert = ("""
+    INSERT INTO songs(song_id, title, artist_id, year, duration)
     VALUES (%s, %s, %s, %s, %s)
+""") + song_table_conflict
+
+# Same as with songs we want to update missing information
+artist_table_conflict = ("""
     ON CONFLICT (artist_id) DO UPDATE
     SET location = COALESCE(excluded.location, artists.location)
         , latitude = COALESCE(excluded.latitude, artists.latitude)
         , longitude = COALESCE(excluded.longitude, artists.longitude);
 """)
 
+artist_table_insert = ("""
+    INSERT INTO artists(artist_id, name, location, latitude, longitude)
+    VALUES (%s, %s, %s, %s, %s)
+""") + artist_table_conflict
+
 # We do not want to update time table, because the infromation will be the same for same start_time.
 # Even if we lost some data in non-index fields we will easier recover it with single update using PRIMARY KEY data.
-time_table_insert = ("""
-    INSERT INTO time(start_time, hour, day, week, month, year, weekday) 
-    VALUES (%s, %s, %s, %s, %s, %s, %s)
+time_table_conflict = ("""
     ON CONFLICT (start_time) DO NOTHING;
 """)
 
+time_table_insert = ("""
+    INSERT INTO time(start_time, hour, day, week, month, year, weekday)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+""") + time_table_conflict
+
 # FIND SONGS
 
 song_select = ("""
@@ -124,6 +304,319 @@ song_select = ("""
         AND s.duration = %s;
 """)
 
+# All songs with the same key fields as in `song_select` to build in-memory lookup index
+song_lookup_select = ("""
+    SELECT s.title, a.name, s.duration, s.song_id, s.artist_id
+    FROM songs s
+    INNER JOIN artists a ON a.artist_id = s.artist_id;
+""")
+
+# LOAD MANIFEST
+
+load_manifest_select = ("""
+    SELECT file_path, file_size, file_mtime, file_hash, status
+    FROM load_manifest;
+""")
+
+load_manifest_upsert = ("""
+    INSERT INTO load_manifest(file_path, file_size, file_mtime, file_hash, status)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (file_path) DO UPDATE
+    SET file_size = excluded.file_size
+        , file_mtime = excluded.file_mtime
+        , file_hash = excluded.file_hash
+        , status = excluded.status
+        , loaded_at = now()
+        , txid = txid_current();
+""")
+
+# MULTI-ROW UPSERTS
+# VALUES placeholder is filled with all rows of the chunk by `psycopg2.extras.execute_values`.
+# Rows have to be unique by the primary key because ON CONFLICT DO UPDATE cannot affect the same row twice.
+
+song_table_bulk_upsert = ("""
+    INSERT INTO songs(song_id, title, artist_id, year, duration)
+    VALUES %s
+""") + song_table_conflict
+
+artist_table_bulk_upsert = ("""
+    INSERT INTO artists(artist_id, name, location, latitude, longitude)
+    VALUES %s
+""") + artist_table_conflict
+
+# BULK LOAD
+# Temporary staging tables are used by the COPY-based loader. Each processed file is streamed into them with
+# COPY FROM STDIN and then moved to the target tables with a single set-based INSERT per table which reuses
+# the same ON CONFLICT rules as the row-by-row inserts above.
+
+time_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS time_staging(
+        start_time timestamp,
+        hour int,
+        day int,
+        week int,
+        month int,
+        year int,
+        weekday int
+    );
+""")
+
+# `ts` column is used only to pick the latest state of the user if he or she appears several times in the same file.
+user_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS user_staging(
+        user_id int,
+        first_name varchar(100),
+        last_name varchar(100),
+        gender char(1),
+        level varchar(100),
+        ts bigint
+    );
+""")
+
+songplay_staging_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS songplay_staging(
+        start_time timestamp,
+        user_id int,
+        level varchar(100),
+        song text,
+        artist text,
+        length numeric,
+        song_id char(18),
+        artist_id char(18),
+        session_id int,
+        location text,
+        user_agent text
+    );
+""")
+
+staging_truncate = "TRUNCATE time_staging, user_staging, songplay_staging;"
+
+copy_from_stdin = "COPY {table}({columns}) FROM STDIN WITH (FORMAT csv);"
+
+# Rows are inserted in the key order to avoid deadlocks between parallel workers which load overlapping keys.
+time_table_bulk_insert = ("""
+    INSERT INTO time(start_time, hour, day, week, month, year, weekday)
+    SELECT start_time, hour, day, week, month, year, weekday
+    FROM time_staging
+    ORDER BY start_time
+""") + time_table_conflict
+
+# ON CONFLICT DO UPDATE cannot affect the same row twice in a single statement,
+# thus we have to keep only the latest entry for each user.
+user_table_bulk_insert = ("""
+    INSERT INTO users(user_id, first_name, last_name, gender, level)
+    SELECT DISTINCT ON (user_id) user_id, first_name, last_name, gender, level
+    FROM user_staging
+    ORDER BY user_id, ts DESC
+""") + user_table_conflict
+
+# Same lookup as `song_select` but for the whole file at once. LATERAL with LIMIT 1 keeps the row-by-row semantics
+# where only the first found song is used for each event.
+songplay_table_bulk_insert = ("""
+    INSERT INTO songplays(start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+    SELECT e.start_time, e.user_id, e.level, sa.song_id, sa.artist_id, e.session_id, e.location, e.user_agent
+    FROM songplay_staging e
+    LEFT JOIN LATERAL (
+        SELECT s.song_id, s.artist_id
+        FROM songs s
+        INNER JOIN artists a ON a.artist_id = s.artist_id
+        WHERE s.title = e.song
+            AND a.name = e.artist
+            AND s.duration = e.length
+        LIMIT 1
+    ) sa ON TRUE;
+""")
+
+# Songs and artists are already resolved with in-memory lookup index before the COPY
+songplay_table_resolved_bulk_insert = ("""
+    INSERT INTO songplays(start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+    SELECT start_time, user_id, level, song_id, artist_id, session_id, location, user_agent
+    FROM songplay_staging;
+""")
+
+# STAGING MERGE
+# Raw data is copied to the staging tables and then merged to the star schema tables with a single statement
+# per table. The merge uses the same ON CONFLICT rules as the row-by-row inserts.
+
+staging_events_columns = ('artist', 'auth', 'firstName', 'gender', 'itemInSession', 'lastName', 'length', 'level',
+                          'location', 'method', 'page', 'registration', 'sessionId', 'song', 'status', 'ts',
+                          'userAgent', 'userId')
+
+staging_songs_columns = ('num_songs', 'artist_id', 'artist_latitude', 'artist_longitude', 'artist_location',
+                         'artist_name', 'song_id', 'title', 'duration', 'year')
+
+# Several records of the same song in staging are merged into one, MAX skips NULLs the same way as COALESCE does.
+song_table_merge = ("""
+    INSERT INTO songs(song_id, title, artist_id, year, duration)
+    SELECT song_id, MIN(title), MAX(artist_id), MAX(year), MAX(duration)
+    FROM stg_songs
+    WHERE song_id IS NOT NULL
+        AND title IS NOT NULL
+    GROUP BY song_id
+    ORDER BY song_id
+""") + song_table_conflict
+
+artist_table_merge = ("""
+    INSERT INTO artists(artist_id, name, location, latitude, longitude)
+    SELECT artist_id, MIN(artist_name), MAX(artist_location), MAX(artist_latitude), MAX(artist_longitude)
+    FROM stg_songs
+    WHERE artist_id IS NOT NULL
+        AND artist_name IS NOT NULL
+    GROUP BY artist_id
+    ORDER BY artist_id
+""") + artist_table_conflict
+
+# `week` is ISO week and `weekday` starts from Monday = 0 to match values produced by pandas in `etl.py`
+time_table_merge = ("""
+    INSERT INTO time(start_time, hour, day, week, month, year, weekday)
+    SELECT start_time
+        , EXTRACT(hour FROM start_time)
+        , EXTRACT(day FROM start_time)
+        , EXTRACT(week FROM start_time)
+        , EXTRACT(month FROM start_time)
+        , EXTRACT(year FROM start_time)
+        , EXTRACT(isodow FROM start_time) - 1
+    FROM (
+        SELECT DISTINCT TIMESTAMP 'epoch' + ts * INTERVAL '1 millisecond' AS start_time
+        FROM stg_events
+        WHERE page = 'NextSong'
+    ) e
+    ORDER BY start_time
+""") + time_table_conflict
+
+user_table_merge = ("""
+    INSERT INTO users(user_id, first_name, last_name, gender, level)
+    SELECT DISTINCT ON (userId) userId, firstName, lastName, gender, level
+    FROM stg_events
+    WHERE page = 'NextSong'
+        AND userId IS NOT NULL
+    ORDER BY userId, ts DESC
+""") + user_table_conflict
+
+songplay_table_merge = ("""
+    INSERT INTO songplays(start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+    SELECT TIMESTAMP 'epoch' + e.ts * INTERVAL '1 millisecond'
+        , e.userId
+        , e.level
+        , sa.song_id
+        , sa.artist_id
+        , e.sessionId
+        , e.location
+        , e.userAgent
+    FROM stg_events e
+    LEFT JOIN LATERAL (
+        SELECT s.song_id, s.artist_id
+        FROM songs s
+        INNER JOIN artists a ON a.artist_id = s.artist_id
+        WHERE s.title = e.song
+            AND a.name = e.artist
+            AND s.duration = e.length
+        LIMIT 1
+    ) sa ON TRUE
+    WHERE e.page = 'NextSong';
+""")
+
+staging_songs_truncate = "TRUNCATE stg_songs;"
+staging_events_truncate = "TRUNCATE stg_events;"
+
+# ROLLUPS
+# Songplays inserted by the ETL pipeline are also saved to the temporary `songplay_delta` table
+# and added to the rollup tables after each processed file. Delta is collected by data-modifying CTE,
+# so it contains exactly the inserted rows whichever way songs were resolved.
+
+songplay_delta_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS songplay_delta(
+        start_time timestamp,
+        user_id int,
+        level varchar(100),
+        song_id char(18),
+        artist_id char(18)
+    );
+""")
+
+songplay_delta_capture = ("""
+    WITH new_songplays AS (
+        {insert}
+        RETURNING start_time, user_id, level, song_id, artist_id
+    )
+    INSERT INTO songplay_delta(start_time, user_id, level, song_id, artist_id)
+    SELECT start_time, user_id, level, song_id, artist_id
+    FROM new_songplays;
+""")
+
+songplay_table_tracked_insert = songplay_delta_capture.format(insert=songplay_table_insert.strip().rstrip(';'))
+songplay_table_tracked_bulk_insert = songplay_delta_capture.format(
+    insert=songplay_table_bulk_insert.strip().rstrip(';'))
+songplay_table_tracked_resolved_bulk_insert = songplay_delta_capture.format(
+    insert=songplay_table_resolved_bulk_insert.strip().rstrip(';'))
+songplay_table_tracked_merge = songplay_delta_capture.format(insert=songplay_table_merge.strip().rstrip(';'))
+
+songplay_delta_truncate = "TRUNCATE songplay_delta;"
+
+# songplays of the delta which are not matched to any song, counted the same way for all load modes
+songplay_delta_unmatched_select = "SELECT COUNT(*) FILTER (WHERE song_id IS NULL) FROM songplay_delta;"
+
+# Rollups are built from `{source}` table: `songplay_delta` for the incremental update after each file
+# and `songplays` for the full refresh. Rows are upserted in the key order to avoid deadlocks between
+# parallel workers which load events of the same hours and days.
+
+plays_per_hour_upsert = ("""
+    INSERT INTO plays_per_hour(hour, play_count)
+    SELECT date_trunc('hour', start_time), COUNT(*)
+    FROM {source}
+    GROUP BY 1
+    ORDER BY 1
+    ON CONFLICT (hour) DO UPDATE
+    SET play_count = plays_per_hour.play_count + excluded.play_count;
+""")
+
+user_daily_plays_upsert = ("""
+    INSERT INTO user_daily_plays(day, user_id, play_count)
+    SELECT start_time::date, user_id, COUNT(*)
+    FROM {source}
+    WHERE user_id IS NOT NULL
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (day, user_id) DO UPDATE
+    SET play_count = user_daily_plays.play_count + excluded.play_count;
+""")
+
+song_daily_plays_upsert = ("""
+    INSERT INTO song_daily_plays(day, song_id, play_count)
+    SELECT start_time::date, song_id, COUNT(*)
+    FROM {source}
+    WHERE song_id IS NOT NULL
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (day, song_id) DO UPDATE
+    SET play_count = song_daily_plays.play_count + excluded.play_count;
+""")
+
+artist_daily_plays_upsert = ("""
+    INSERT INTO artist_daily_plays(day, artist_id, play_count)
+    SELECT start_time::date, artist_id, COUNT(*)
+    FROM {source}
+    WHERE artist_id IS NOT NULL
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (day, artist_id) DO UPDATE
+    SET play_count = artist_daily_plays.play_count + excluded.play_count;
+""")
+
+level_daily_plays_upsert = ("""
+    INSERT INTO level_daily_plays(day, level, play_count)
+    SELECT start_time::date, level, COUNT(*)
+    FROM {source}
+    WHERE level IS NOT NULL
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (day, level) DO UPDATE
+    SET play_count = level_daily_plays.play_count + excluded.play_count;
+""")
+
+rollup_table_truncate = ("TRUNCATE plays_per_hour, user_daily_plays, song_daily_plays, artist_daily_plays, "
+                         "level_daily_plays;")
+
 # QUERY LISTS
 
 create_table_queries = [
@@ -131,7 +624,33 @@ create_table_queries = [
     user_table_create,
     song_table_create,
     artist_table_create,
-    time_table_create
+    time_table_create,
+    load_manifest_table_create,
+    staging_events_table_create,
+    staging_songs_table_create,
+    plays_per_hour_table_create,
+    user_daily_plays_table_create,
+    song_daily_plays_table_create,
+    artist_daily_plays_table_create,
+    level_daily_plays_table_create,
+    song_title_index_create
+]
+
+create_partitioned_table_queries = [
+    songplay_partitioned_table_create,
+    *create_table_queries[1:]
+]
+
+songplay_index_queries = [
+    songplay_start_time_index_create,
+    songplay_user_id_index_create,
+    songplay_song_id_index_create
+]
+
+songplay_index_drop_queries = [
+    songplay_start_time_index_drop,
+    songplay_user_id_index_drop,
+    songplay_song_id_index_drop
 ]
 
 drop_table_queries = [
@@ -139,5 +658,47 @@ drop_table_queries = [
     user_table_drop,
     song_table_drop,
     artist_table_drop,
-    time_table_drop
+    time_table_drop,
+    load_manifest_table_drop,
+    staging_events_table_drop,
+    staging_songs_table_drop,
+    rollup_table_drop
+]
+
+staging_table_queries = [
+    time_staging_create,
+    user_staging_create,
+    songplay_staging_create,
+    songplay_delta_create
+]
+
+song_merge_queries = [
+    artist_table_merge,
+    song_table_merge,
+    staging_songs_truncate
+]
+
+log_merge_queries = [
+    time_table_merge,
+    user_table_merge,
+    songplay_table_tracked_merge,
+    staging_events_truncate
+]
+
+rollup_upserts = [
+    plays_per_hour_upsert,
+    user_daily_plays_upsert,
+    song_daily_plays_upsert,
+    artist_daily_plays_upsert,
+    level_daily_plays_upsert
+]
+
+rollup_update_queries = [
+    *[query.format(source='songplay_delta') for query in rollup_upserts],
+    songplay_delta_truncate
+]
+
+rollup_refresh_queries = [
+    rollup_table_truncate,
+    *[query.format(source='songplays') for query in rollup_upserts]
 ]
@@ -0,0 +1,139 @@
+import os
+import csv
+import glob
+import argparse
+import multiprocessing
+from decimal import Decimal
+from collections import deque
+
+# Columns of the consolidated event data file and their types. Prepared statements require exact types,
+# so `length` is converted to Decimal for the `decimal` columns.
+EVENT_FIELDS = [
+    ('artist', str),
+    ('firstName', str),
+    ('gender', str),
+    ('itemInSession', int),
+    ('lastName', str),
+    ('length', Decimal),
+    ('level', str),
+    ('location', str),
+    ('sessionId', int),
+    ('song', str),
+    ('userId', int),
+]
+EVENT_COLUMNS = [name for name, _ in EVENT_FIELDS]
+
+# Indexes of the event columns in the original daily event files
+SOURCE_INDEXES = (0, 2, 3, 4, 5, 6, 7, 8, 12, 13, 16)
+
+csv.register_dialect('myDialect', quoting=csv.QUOTE_ALL, skipinitialspace=True)
+
+
+def get_event_files(filepath):
+    """Return sorted list of all CSV files in the directory and its subdirectories, so days are processed in order."""
+
+    file_path_list = []
+    for root, dirs, files in os.walk(filepath):
+        file_path_list.extend(glob.glob(os.path.join(root, '*.csv')))
+
+    return sorted(file_path_list)
+
+
+def read_event_file(filepath):
+    """Read daily event file and yield events with artist only, projected to the consolidated columns."""
+
+    with open(filepath, 'r', encoding='utf8', newline='') as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader)
+
+        for row in csvreader:
+            if row[0] == '':
+                continue
+            yield [row[i] for i in SOURCE_INDEXES]
+
+
+def read_event_file_rows(filepath):
+    """Read all projected events of the daily event file to the list, it is used by the worker processes."""
+
+    return list(read_event_file(filepath))
+
+
+def stream_events(file_path_list, workers=1):
+    """
+    Yield projected events of all files in the order of the files.
+
+    With several workers files are read by the pool of processes. At most two files per worker are read ahead
+    and results are yielded in the original order, so memory usage is bounded by a few daily files.
+    """
+
+    if workers <= 1:
+        for filepath in file_path_list:
+            yield from read_event_file(filepath)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        files = iter(file_path_list)
+        pending = deque()
+
+        for filepath in files:
+            pending.append(pool.apply_async(read_event_file_rows, (filepath,)))
+            if len(pending) >= 2 * workers:
+                break
+
+        while pending:
+            rows = pending.popleft().get()
+
+            # keep the pool busy while the rows of the current file are consumed
+            filepath = next(files, None)
+            if filepath is not None:
+                pending.append(pool.apply_async(read_event_file_rows, (filepath,)))
+
+            yield from rows
+
+
+def convert_event(line):
+    """Convert row of the event data file to the dictionary of typed event fields."""
+
+    return {name: field_type(value) for (name, field_type), value in zip(EVENT_FIELDS, line)}
+
+
+def read_events(filepath):
+    """Read events from the consolidated event data file, header is skipped and every row is converted once."""
+
+    with open(filepath, encoding='utf8', newline='') as f:
+        csvreader = csv.reader(f)
+        next(csvreader)
+        for line in csvreader:
+            yield convert_event(line)
+
+
+def write_events(events, filepath):
+    """Write events to the consolidated event data file as they come, return number of written events."""
+
+    num_events = 0
+    with open(filepath, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f, dialect='myDialect')
+        writer.writerow(EVENT_COLUMNS)
+        for row in events:
+            writer.writerow(row)
+            num_events += 1
+
+    return num_events
+
+
+def main():
+    """Consolidate daily event files to a single event data file."""
+
+    parser = argparse.ArgumentParser(description='Consolidate Sparkify daily event files to a single CSV file.')
+    parser.add_argument('--input', default='event_data', help='directory with daily event files')
+    parser.add_argument('--output', default='event_datafile_new.csv', help='consolidated event data file')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes which read event files')
+    args = parser.parse_args()
+
+    file_path_list = get_event_files(args.input)
+    num_events = write_events(stream_events(file_path_list, args.workers), args.output)
+    print('{} events from {} files are written to {}'.format(num_events, len(file_path_list), args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# KEYSPACE
+
+keyspace_create = ("""
+    CREATE KEYSPACE IF NOT EXISTS sparkify
+    WITH REPLICATION =
+    { 'class' : 'SimpleStrategy', 'replication_factor' : 1 };
+""")
+
+# DROP TABLES
+
+music_app_sessions_table_drop = "DROP TABLE IF EXISTS music_app_sessions;"
+user_sessions_table_drop = "DROP TABLE IF EXISTS user_sessions;"
+song_listeners_table_drop = "DROP TABLE IF EXISTS song_listeners;"
+
+# CREATE TABLES
+# Primary keys are explained in the notebook. INSERT statements are built from the column mappings
+# in `query_tables.py`.
+
+# Query 1: artist, song title and song's length heard during sessionId = 338 and itemInSession = 4
+music_app_sessions_table_create = ("""
+    CREATE TABLE IF NOT EXISTS music_app_sessions(
+        sessionId int,
+        itemInSession int,
+        artist text,
+        song text,
+        song_length decimal,
+        PRIMARY KEY ((sessionId, itemInSession)));
+""")
+
+# Query 2: artist, song (sorted by itemInSession) and user name for userId = 10 and sessionId = 182
+user_sessions_table_create = ("""
+    CREATE TABLE IF NOT EXISTS user_sessions(
+        userId int,
+        sessionId int,
+        itemInSession int,
+        artist text,
+        song text,
+        user_first_name text,
+        user_last_name text,
+        PRIMARY KEY ((userId, sessionId), itemInSession))
+        WITH CLUSTERING ORDER BY (itemInSession ASC);
+""")
+
+# Query 3: every user name who listened to the song 'All Hands Against His Own'
+song_listeners_table_create = ("""
+    CREATE TABLE IF NOT EXISTS song_listeners(
+        song text,
+        user_id int,
+        user_first_name text,
+        user_last_name text,
+        PRIMARY KEY (song, user_id));
+""")
+
+# VERIFY QUERIES
+
+music_app_sessions_select = ("""
+    SELECT artist, song, song_length
+    FROM music_app_sessions
+    WHERE sessionId = 338
+    AND itemInSession = 4;
+""")
+
+user_sessions_select = ("""
+    SELECT artist, song, user_first_name, user_last_name
+    FROM user_sessions
+    WHERE userid = 10
+    AND sessionid = 182;
+""")
+
+song_listeners_select = ("""
+    SELECT user_first_name, user_last_name
+    FROM song_listeners
+    WHERE song = 'All Hands Against His Own';
+""")
+
+# QUERY LISTS
+
+create_table_queries = [
+    music_app_sessions_table_create,
+    user_sessions_table_create,
+    song_listeners_table_create
+]
+
+drop_table_queries = [
+    music_app_sessions_table_drop,
+    user_sessions_table_drop,
+    song_listeners_table_drop
+]
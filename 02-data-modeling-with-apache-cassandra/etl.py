@@ -0,0 +1,99 @@
+import argparse
+from cassandra.cluster import Cluster
+from cql_queries import *
+from loader import FanOutLoader, WRITERS
+from consolidate import get_event_files, stream_events, convert_event, read_events
+from query_tables import QUERY_TABLES
+
+
+def read_event_data(filepath, workers=1):
+    """Read events directly from the daily event files without the consolidated file, every row is converted once."""
+
+    for line in stream_events(get_event_files(filepath), workers):
+        yield convert_event(line)
+
+
+def connect(hosts):
+    """Connect to Cassandra cluster, create keyspace `sparkify` if it does not exist and return cluster and session."""
+
+    cluster = Cluster(hosts)
+    session = cluster.connect()
+    session.execute(keyspace_create)
+    session.set_keyspace('sparkify')
+    return cluster, session
+
+
+def drop_tables(session):
+    """Drop all query tables."""
+
+    for query in drop_table_queries:
+        session.execute(query)
+
+
+def create_tables(session):
+    """Create all query tables if they do not exist."""
+
+    for query in create_table_queries:
+        session.execute(query)
+
+
+def load_events(session, events, tables, writer_factory=WRITERS['concurrent'], **writer_options):
+    """
+    Load events to all given query tables in a single pass and report throughput of every table.
+    Rows are written by the writers created with the writer factory and options.
+    """
+
+    loader = FanOutLoader(session, tables, writer_factory, **writer_options)
+    loader.load(events)
+    loader.report()
+    return loader
+
+
+def main():
+    """Load consolidated event data file to the Cassandra query tables."""
+
+    parser = argparse.ArgumentParser(description='Load Sparkify event data to the Cassandra query tables.')
+    parser.add_argument('--file', default='event_datafile_new.csv', help='consolidated event data file')
+    parser.add_argument('--event-data', default=None,
+                        help='directory with daily event files, if it is set then events are streamed directly '
+                             'from them and the consolidated file is not used')
+    parser.add_argument('--read-workers', type=int, default=1,
+                        help='number of processes which read daily event files')
+    parser.add_argument('--hosts', nargs='+', default=['127.0.0.1'], help='contact points of the Cassandra cluster')
+    parser.add_argument('--tables', nargs='+', choices=[table.name for table in QUERY_TABLES],
+                        default=[table.name for table in QUERY_TABLES], help='query tables to load')
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='maximum number of in-flight write requests')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='number of retries of the row failed with timeout or unavailable error')
+    parser.add_argument('--write-mode', choices=WRITERS.keys(), default='concurrent',
+                        help='write every row with its own request or group rows by partition key '
+                             'to UNLOGGED batches')
+    parser.add_argument('--batch-rows', type=int, default=100, help='maximum number of rows in a batch')
+    parser.add_argument('--batch-bytes', type=int, default=5 * 1024,
+                        help='maximum estimated size of values in a batch')
+    parser.add_argument('--buffer-rows', type=int, default=10000,
+                        help='number of rows buffered by each writer before they are written')
+    parser.add_argument('--recreate', action='store_true', help='drop and create query tables before the load')
+    args = parser.parse_args()
+
+    cluster, session = connect(args.hosts)
+
+    if args.recreate:
+        drop_tables(session)
+    create_tables(session)
+
+    tables = [table for table in QUERY_TABLES if table.name in args.tables]
+    events = read_event_data(args.event_data, args.read_workers) if args.event_data else read_events(args.file)
+    writer_options = {'concurrency': args.concurrency, 'retries': args.retries, 'chunk_size': args.buffer_rows}
+    if args.write_mode == 'batch':
+        writer_options.update(batch_rows=args.batch_rows, batch_bytes=args.batch_bytes)
+
+    load_events(session, events, tables, WRITERS[args.write_mode], **writer_options)
+
+    session.shutdown()
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import time
+from collections import defaultdict
+from cassandra import WriteTimeout, Unavailable, OperationTimedOut
+from cassandra.cluster import NoHostAvailable
+from cassandra.query import BatchStatement, BatchType
+from cassandra.concurrent import execute_concurrent
+
+# Errors which are worth to retry: the coordinator or replicas are temporarily overloaded or unreachable.
+# Other errors, for example invalid values, fail the row immediately.
+RETRY_ERRORS = (WriteTimeout, Unavailable, OperationTimedOut, NoHostAvailable)
+
+
+class ConcurrentWriter:
+    """
+    Writer of rows to a single Cassandra table.
+
+    INSERT statement is prepared once and rows are written with the driver's concurrent execution,
+    so up to `concurrency` requests are in flight at the same time. Rows are buffered and written by chunks,
+    thus memory usage does not depend on the number of rows. Rows failed with one of the retry errors are written
+    again up to `retries` times with exponential backoff, other failed rows are reported and skipped.
+    """
+
+    def __init__(self, session, query, concurrency=100, retries=3, retry_errors=RETRY_ERRORS, backoff=0.1,
+                 chunk_size=10000):
+        self.session = session
+        self.statement = session.prepare(query)
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_errors = retry_errors
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+
+        self.buffer = []
+        self.rows = 0
+        self.failed = 0
+        self.retried = 0
+        self.seconds = 0.0
+
+    def add(self, row):
+        """Add row to the buffer and write the buffer if it is full, row is a tuple of the statement parameters."""
+
+        self.buffer.append(row)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows."""
+
+        if not self.buffer:
+            return
+
+        start = time.perf_counter()
+        self._write_chunk(self.buffer)
+        self.buffer = []
+        self.seconds += time.perf_counter() - start
+
+    def write(self, rows):
+        """Write all rows to the table, each row is a tuple of the INSERT statement parameters."""
+
+        for row in rows:
+            self.add(row)
+        self.flush()
+
+    def _write_chunk(self, rows):
+        """Write chunk of rows concurrently, one request per row."""
+
+        self._execute([(self.statement, row, [row]) for row in rows])
+
+    def _execute(self, requests):
+        """
+        Execute requests concurrently and retry failed ones.
+        Each request is a tuple of statement, its parameters and list of rows written by the request.
+        """
+
+        for attempt in range(self.retries + 1):
+            statements = [(statement, parameters) for statement, parameters, _ in requests]
+            results = execute_concurrent(self.session, statements, concurrency=self.concurrency,
+                                         raise_on_first_error=False)
+
+            # results are returned in the same order as requests
+            retry_requests = []
+            for request, (success, result) in zip(requests, results):
+                rows = request[2]
+                if success:
+                    self.rows += len(rows)
+                elif isinstance(result, self.retry_errors) and attempt < self.retries:
+                    retry_requests.append(request)
+                else:
+                    self.failed += len(rows)
+                    print('Failed to write rows {}: {}'.format(rows, result))
+
+            if not retry_requests:
+                return
+
+            self.retried += sum(len(rows) for _, _, rows in retry_requests)
+            requests = retry_requests
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def report(self, name):
+        """Print number of written, retried and failed rows and throughput to output."""
+
+        rows_per_second = self.rows / self.seconds if self.seconds else 0
+        print('{}: {} rows written in {:.2f} seconds ({:.0f} rows/s), {} retried, {} failed.'.format(
+            name, self.rows, self.seconds, rows_per_second, self.retried, self.failed))
+
+
+class BatchWriter(ConcurrentWriter):
+    """
+    Writer of rows to a single Cassandra table with UNLOGGED batches grouped by partition key.
+
+    Buffered rows are grouped by the partition key of the table, rows of the same partition are written with
+    UNLOGGED BATCH statements of at most `batch_rows` rows and `batch_bytes` bytes of values, so every batch is
+    applied by the replicas of a single partition. Partitions with a single row are written with the plain INSERT.
+    Batches are executed concurrently and retried the same way as single rows in `ConcurrentWriter`.
+    Grouping works only within the buffer, so larger `chunk_size` gives larger batches.
+    """
+
+    def __init__(self, session, query, batch_rows=100, batch_bytes=5 * 1024, **options):
+        super().__init__(session, query, **options)
+        self.batch_rows = batch_rows
+        self.batch_bytes = batch_bytes
+        self.batches = 0
+
+        # indexes of the partition key columns in the statement parameters are known from the table metadata
+        self.partition_key_indexes = self.statement.routing_key_indexes or [0]
+
+    def _write_chunk(self, rows):
+        """Write chunk of rows with batches grouped by partition key."""
+
+        partitions = defaultdict(list)
+        for row in rows:
+            partitions[tuple(row[i] for i in self.partition_key_indexes)].append(row)
+
+        requests = []
+        for partition_rows in partitions.values():
+            if len(partition_rows) == 1:
+                requests.append((self.statement, partition_rows[0], partition_rows))
+                continue
+
+            for batch_rows in self._split_batches(partition_rows):
+                batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+                for row in batch_rows:
+                    batch.add(self.statement, row)
+                requests.append((batch, None, batch_rows))
+                self.batches += 1
+
+        self._execute(requests)
+
+    def _split_batches(self, rows):
+        """Split rows of a single partition to the lists limited by number of rows and estimated size of values."""
+
+        batch_rows = []
+        batch_bytes = 0
+        for row in rows:
+            row_bytes = sum(len(str(value)) for value in row)
+            if batch_rows and (len(batch_rows) >= self.batch_rows or batch_bytes + row_bytes > self.batch_bytes):
+                yield batch_rows
+                batch_rows = []
+                batch_bytes = 0
+
+            batch_rows.append(row)
+            batch_bytes += row_bytes
+
+        if batch_rows:
+            yield batch_rows
+
+    def report(self, name):
+        """Print number of written, retried and failed rows, number of batches and throughput to output."""
+
+        super().report(name)
+        print('{}: {} batches written.'.format(name, self.batches))
+
+
+# Writers available for the `--write-mode` option
+WRITERS = {
+    'concurrent': ConcurrentWriter,
+    'batch': BatchWriter,
+}
+
+
+class FanOutLoader:
+    """
+    Loader of the event stream to several query tables in a single pass.
+
+    Every event is converted once and then each query table takes its own columns from it and passes the row
+    to its own writer. Writers are independent, so failed rows of one table do not affect the other tables.
+    """
+
+    def __init__(self, session, tables, writer_factory=ConcurrentWriter, **writer_options):
+        self.tables = tables
+        self.writers = [writer_factory(session, table.insert_query, **writer_options) for table in tables]
+        self.events = 0
+        self.seconds = 0.0
+
+    def load(self, events):
+        """Write every event to all query tables."""
+
+        start = time.perf_counter()
+
+        for event in events:
+            self.events += 1
+            for table, writer in zip(self.tables, self.writers):
+                writer.add(table.get_row(event))
+
+        for writer in self.writers:
+            writer.flush()
+
+        self.seconds += time.perf_counter() - start
+
+    def report(self):
+        """Print statistics of every query table and total throughput to output."""
+
+        for table, writer in zip(self.tables, self.writers):
+            writer.report(table.name)
+
+        rows = sum(writer.rows for writer in self.writers)
+        print('{} events loaded to {} tables in {:.2f} seconds ({:.0f} rows/s).'.format(
+            self.events, len(self.tables), self.seconds, rows / self.seconds if self.seconds else 0))
@@ -0,0 +1,206 @@
+import math
+import bisect
+import random
+import struct
+import hashlib
+import argparse
+from decimal import Decimal
+from collections import defaultdict
+from consolidate import read_events
+from query_tables import QueryTable, QUERY_TABLES
+
+# Cassandra driver is used only to compute exact Murmur3 tokens, without it tokens are approximated with MD5
+try:
+    from cassandra.murmur3 import murmur3
+except ImportError:
+    murmur3 = None
+
+
+def serialize_value(value):
+    """Serialize value the same way as Cassandra does for int, decimal and text columns."""
+
+    if isinstance(value, int):
+        return struct.pack('>i', value)
+
+    if isinstance(value, Decimal):
+        sign, digits, exponent = value.as_tuple()
+        unscaled = int(''.join(map(str, digits)) or '0') * (-1 if sign else 1)
+        return struct.pack('>i', -exponent) + unscaled.to_bytes(unscaled.bit_length() // 8 + 1, 'big', signed=True)
+
+    return str(value).encode('utf8')
+
+
+def serialize_partition_key(values):
+    """Serialize partition key, composite keys are encoded as components with length prefix and end byte."""
+
+    if len(values) == 1:
+        return serialize_value(values[0])
+
+    key = b''
+    for value in values:
+        component = serialize_value(value)
+        key += struct.pack('>H', len(component)) + component + b'\x00'
+    return key
+
+
+def get_token(key):
+    """Return Murmur3Partitioner token of the serialized partition key."""
+
+    if murmur3 is not None:
+        return murmur3(key)
+    return struct.unpack('>q', hashlib.md5(key).digest()[:8])[0]
+
+
+def percentile(values, share):
+    """Return value at the given share (0..1) of the sorted list of values."""
+
+    if not values:
+        return 0
+    return values[max(0, math.ceil(share * len(values)) - 1)]
+
+
+class TokenRing:
+    """Token ring of the cluster with given number of nodes, each node owns `vnodes` random tokens."""
+
+    def __init__(self, nodes, vnodes=16, seed=42):
+        rng = random.Random(seed)
+        ring = sorted((rng.randint(-2 ** 63, 2 ** 63 - 1), node) for node in range(nodes) for _ in range(vnodes))
+        self.nodes = nodes
+        self.tokens = [token for token, _ in ring]
+        self.owners = [node for _, node in ring]
+
+    def get_node(self, token):
+        """Return node which owns the token: the node of the first ring token which is not less than it."""
+
+        return self.owners[bisect.bisect_left(self.tokens, token) % len(self.tokens)]
+
+
+class PartitionStats:
+    """
+    Sizes of the partitions of a query table which would be created from the event stream.
+
+    Rows are identified by the primary key, so repeated events overwrite each other as in Cassandra.
+    Size of the row is the size of its serialized values without Cassandra storage overhead.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.partition_fields = [table.get_field(column) for column in table.partition_key]
+        self.clustering_fields = [table.get_field(column) for column in table.clustering]
+        self.partitions = defaultdict(dict)
+
+    def add(self, event):
+        """Add the row of the event to its partition."""
+
+        partition = tuple(event[field] for field in self.partition_fields)
+        clustering = tuple(event[field] for field in self.clustering_fields)
+        self.partitions[partition][clustering] = sum(len(serialize_value(value)) for value in self.table.get_row(event))
+
+    def report(self, ring):
+        """Print histogram of partition sizes, largest partitions and distribution of data between nodes."""
+
+        rows = sorted(len(partition) for partition in self.partitions.values())
+        sizes = sorted(sum(partition.values()) for partition in self.partitions.values())
+        num_partitions = len(rows)
+
+        print('Table {}: PRIMARY KEY (({}){})'.format(
+            self.table.name, ', '.join(self.table.partition_key),
+            ''.join(', ' + column for column in self.table.clustering)))
+        print('    {} partitions, {} rows, {} bytes'.format(num_partitions, sum(rows), sum(sizes)))
+        if not num_partitions:
+            return
+
+        print('    rows per partition: mean {:.1f}, p99 {}, max {}'.format(
+            sum(rows) / num_partitions, percentile(rows, 0.99), rows[-1]))
+        print('    bytes per partition: mean {:.0f}, p99 {}, max {}'.format(
+            sum(sizes) / num_partitions, percentile(sizes, 0.99), sizes[-1]))
+
+        # partitions are counted in the buckets of rows per partition: 1, 2-3, 4-7, 8-15, ...
+        histogram = defaultdict(int)
+        for count in rows:
+            histogram[count.bit_length() - 1] += 1
+        print('    partitions by rows per partition:')
+        for bucket in sorted(histogram):
+            low, high = 2 ** bucket, 2 ** (bucket + 1) - 1
+            label = str(low) if low == high else '{}-{}'.format(low, high)
+            print('        {:>12} {:>10}'.format(label, histogram[bucket]))
+
+        # data of every partition is stored on the node which owns its token
+        node_rows = [0] * ring.nodes
+        node_bytes = [0] * ring.nodes
+        for partition, partition_rows in self.partitions.items():
+            node = ring.get_node(get_token(serialize_partition_key(partition)))
+            node_rows[node] += len(partition_rows)
+            node_bytes[node] += sum(partition_rows.values())
+
+        mean_rows = sum(node_rows) / ring.nodes
+        mean_bytes = sum(node_bytes) / ring.nodes
+        print('    {} nodes: rows per node min {}, max {}, skew {:.2f}; bytes per node min {}, max {}, skew {:.2f}'
+              .format(ring.nodes, min(node_rows), max(node_rows), max(node_rows) / mean_rows if mean_rows else 0,
+                      min(node_bytes), max(node_bytes), max(node_bytes) / mean_bytes if mean_bytes else 0))
+
+
+def analyze(events, tables):
+    """Return statistics of partitions of all given query tables built from the events in a single pass."""
+
+    stats = [PartitionStats(table) for table in tables]
+    for event in events:
+        for table_stats in stats:
+            table_stats.add(event)
+    return stats
+
+
+def main():
+    """Analyze partition sizes and distribution between nodes of the query tables."""
+
+    parser = argparse.ArgumentParser(
+        description='Estimate partition sizes and hot spots of the Cassandra query tables from the event data file.')
+    parser.add_argument('--file', default='event_datafile_new.csv', help='consolidated event data file')
+    parser.add_argument('--tables', nargs='+', choices=[table.name for table in QUERY_TABLES],
+                        default=[table.name for table in QUERY_TABLES], help='query tables to analyze')
+    parser.add_argument('--partition-key', nargs='+', default=None,
+                        help='alternative partition key columns of the table, only single table can be analyzed')
+    parser.add_argument('--clustering', nargs='*', default=None,
+                        help='alternative clustering columns of the table, only single table can be analyzed')
+    parser.add_argument('--nodes', type=int, default=3, help='number of nodes in the cluster')
+    parser.add_argument('--vnodes', type=int, default=16, help='number of tokens of every node')
+    parser.add_argument('--seed', type=int, default=42, help='seed of the random token assignment')
+    args = parser.parse_args()
+
+    tables = [table for table in QUERY_TABLES if table.name in args.tables]
+    if args.partition_key is not None or args.clustering is not None:
+        if len(tables) != 1:
+            parser.error('alternative primary key can be set for a single table only')
+        table = tables[0]
+        partition_key = args.partition_key or table.partition_key
+        clustering = args.clustering if args.clustering is not None else table.clustering
+
+        column_names = [column for column, _ in table.columns]
+        unknown = [column for column in partition_key + clustering if column not in column_names]
+        if unknown:
+            parser.error('unknown columns of table {}: {}, available columns: {}'.format(
+                table.name, ', '.join(unknown), ', '.join(column_names)))
+        if len(set(partition_key + clustering)) != len(partition_key + clustering):
+            parser.error('every column can be used in the primary key only once')
+
+        # rows with the same new primary key would overwrite each other, so the columns of the current primary key
+        # are kept in the clustering columns to analyze the same rows
+        missing = [column for column in table.partition_key + table.clustering
+                   if column not in partition_key + clustering]
+        if missing:
+            print('Columns {} of the current primary key are added to the clustering columns to keep rows unique.'
+                  .format(', '.join(missing)))
+            clustering = clustering + missing
+
+        tables = [QueryTable(table.name, table.columns, partition_key=partition_key, clustering=clustering)]
+
+    if murmur3 is None:
+        print('Cassandra driver is not installed, tokens are approximated with MD5.')
+
+    ring = TokenRing(args.nodes, args.vnodes, args.seed)
+    for table_stats in analyze(read_events(args.file), tables):
+        table_stats.report(ring)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+class QueryTable:
+    """
+    Declarative definition of the query table which is loaded from the event stream:
+    name of the table and list of (table column, event field) pairs. INSERT statement is built from the mapping.
+    Partition key and clustering columns are the same as in the CREATE statement, they are used by the analyzer.
+    """
+
+    def __init__(self, name, columns, partition_key, clustering=()):
+        self.name = name
+        self.columns = columns
+        self.partition_key = list(partition_key)
+        self.clustering = list(clustering)
+
+    def get_field(self, column):
+        """Return event field which is stored in the table column."""
+
+        return dict(self.columns)[column]
+
+    @property
+    def insert_query(self):
+        """INSERT statement with `?` placeholders to be prepared by the writer."""
+
+        return 'INSERT INTO {}({}) VALUES ({});'.format(
+            self.name, ', '.join(column for column, _ in self.columns), ', '.join('?' for _ in self.columns))
+
+    def get_row(self, event):
+        """Return parameters of the INSERT statement taken from the converted event."""
+
+        return tuple(event[field] for _, field in self.columns)
+
+
+# Query tables loaded by the ETL pipeline, tables are created with the statements from `cql_queries.py`.
+# To add a new query table add its CREATE statement there and its column mapping and primary key here.
+QUERY_TABLES = [
+    QueryTable('music_app_sessions', [
+        ('sessionId', 'sessionId'),
+        ('itemInSession', 'itemInSession'),
+        ('artist', 'artist'),
+        ('song', 'song'),
+        ('song_length', 'length'),
+    ], partition_key=['sessionId', 'itemInSession']),
+    QueryTable('user_sessions', [
+        ('userId', 'userId'),
+        ('sessionId', 'sessionId'),
+        ('itemInSession', 'itemInSession'),
+        ('artist', 'artist'),
+        ('song', 'song'),
+        ('user_first_name', 'firstName'),
+        ('user_last_name', 'lastName'),
+    ], partition_key=['userId', 'sessionId'], clustering=['itemInSession']),
+    QueryTable('song_listeners', [
+        ('song', 'song'),
+        ('user_id', 'userId'),
+        ('user_first_name', 'firstName'),
+        ('user_last_name', 'lastName'),
+    ], partition_key=['song'], clustering=['user_id']),
+]
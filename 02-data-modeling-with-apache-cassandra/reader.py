@@ -0,0 +1,291 @@
+import os
+import queue
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.util import Finalize
+import pandas as pd
+from cassandra.cluster import Cluster
+from cassandra.query import SimpleStatement
+from query_tables import QUERY_TABLES
+
+# pyarrow is required only to read pages as Arrow record batches and to export tables to Parquet
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Murmur3Partitioner token range, the minimum token is never assigned to a partition
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+
+# Cassandra decimal has arbitrary precision while Arrow decimal has fixed precision and scale,
+# decimals are exported with this scale and values with more fractional digits are rejected
+DECIMAL_PRECISION = 38
+DECIMAL_SCALE = 18
+
+
+def read_pages(session, query, parameters=None, fetch_size=5000):
+    """
+    Execute query with the driver paging and yield column names and rows of every page.
+    Only one page is kept in memory, the next page is requested when the current one is consumed.
+    The first page is yielded even if it is empty.
+    """
+
+    result = session.execute(SimpleStatement(query, fetch_size=fetch_size), parameters)
+    while True:
+        yield result.column_names, result.current_rows
+        if not result.has_more_pages:
+            return
+        result.fetch_next_page()
+
+
+def to_dataframe(column_names, rows):
+    """Convert page of rows to DataFrame."""
+
+    return pd.DataFrame.from_records(rows, columns=column_names)
+
+
+def get_arrow_type(cql_type):
+    """Return Arrow type of the column with given CQL type, raise ValueError for unsupported types."""
+
+    arrow_types = {
+        'ascii': pa.string(),
+        'text': pa.string(),
+        'varchar': pa.string(),
+        'boolean': pa.bool_(),
+        'tinyint': pa.int8(),
+        'smallint': pa.int16(),
+        'int': pa.int32(),
+        'bigint': pa.int64(),
+        'counter': pa.int64(),
+        'float': pa.float32(),
+        'double': pa.float64(),
+        'decimal': pa.decimal128(DECIMAL_PRECISION, DECIMAL_SCALE),
+        'timestamp': pa.timestamp('ms'),
+    }
+    if cql_type not in arrow_types:
+        raise ValueError('CQL type {} can not be converted to Arrow'.format(cql_type))
+    return arrow_types[cql_type]
+
+
+def get_arrow_schema(session, table_name, column_names):
+    """
+    Return Arrow schema of the given columns of the table in the current keyspace of the session.
+    Types are taken from the table metadata, so every page is converted to the same schema whatever values it has.
+    """
+
+    if pa is None:
+        raise ImportError('pyarrow is required to read Arrow record batches')
+
+    # unquoted identifiers are stored in lower case in the table metadata and in the result column names
+    columns = session.cluster.metadata.keyspaces[session.keyspace].tables[table_name.lower()].columns
+    return pa.schema([(column.lower(), get_arrow_type(columns[column.lower()].cql_type)) for column in column_names])
+
+
+def to_record_batch(column_names, rows, schema=None):
+    """
+    Convert page of rows to Arrow record batch. If schema is not given then types are inferred from the values
+    of the page, so pages of the same query may get different types, for example when a column is empty.
+    """
+
+    if pa is None:
+        raise ImportError('pyarrow is required to read Arrow record batches')
+
+    columns = list(zip(*rows)) if rows else [[] for _ in column_names]
+    if schema is None:
+        return pa.RecordBatch.from_arrays([pa.array(column) for column in columns], names=column_names)
+    return pa.RecordBatch.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                                      schema=schema)
+
+
+def read_dataframes(session, query, parameters=None, fetch_size=5000):
+    """Execute query and yield DataFrame per page of the result."""
+
+    for column_names, rows in read_pages(session, query, parameters, fetch_size):
+        yield to_dataframe(column_names, rows)
+
+
+def read_record_batches(session, query, parameters=None, fetch_size=5000, schema=None):
+    """
+    Execute query and yield Arrow record batch per page of the result.
+    Pass schema from `get_arrow_schema` to get the same types for every page.
+    """
+
+    for column_names, rows in read_pages(session, query, parameters, fetch_size):
+        yield to_record_batch(column_names, rows, schema)
+
+
+def get_token_ranges(splits):
+    """Split the whole token ring to the given number of (start, end] ranges of the same size."""
+
+    step = (MAX_TOKEN - MIN_TOKEN) // splits
+    bounds = [MIN_TOKEN + i * step for i in range(splits)] + [MAX_TOKEN]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def get_range_query(table):
+    """Return query which selects all columns of the query table within the token range of its partition key."""
+
+    partition_key = ', '.join(table.partition_key)
+    return 'SELECT {} FROM {} WHERE token({}) > %s AND token({}) <= %s;'.format(
+        ', '.join(column for column, _ in table.columns), table.name, partition_key, partition_key)
+
+
+def scan_table(session, table, splits=64, workers=8, fetch_size=5000, convert=to_dataframe):
+    """
+    Read the whole query table with parallel scans of token ranges and yield converted pages as they arrive.
+
+    Each of `workers` threads reads its token ranges page by page, so requests go to different coordinators
+    and nodes at the same time. Pages are passed through a bounded queue, thus at most two pages per worker
+    are kept in memory. Pages are yielded in the order of arrival, not in the order of tokens.
+    If the scan fails or the caller stops the iteration early, the threads are stopped before the function returns.
+    """
+
+    query = get_range_query(table)
+    ranges = queue.Queue()
+    for token_range in get_token_ranges(splits):
+        ranges.put(token_range)
+    pages = queue.Queue(maxsize=2 * workers)
+    done = object()
+    stop = threading.Event()
+
+    def put(page):
+        # waits while the queue is full, but gives up when the scan is stopped and nobody reads the queue
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def scan():
+        try:
+            while not stop.is_set():
+                try:
+                    token_range = ranges.get_nowait()
+                except queue.Empty:
+                    return
+                for column_names, rows in read_pages(session, query, token_range, fetch_size):
+                    if stop.is_set():
+                        return
+                    if rows:
+                        put(convert(column_names, rows))
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = [executor.submit(scan) for _ in range(workers)]
+    try:
+        running = workers
+        while running:
+            page = pages.get()
+            if page is done:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        stop.set()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+# Connection of the export worker process, see `init_export_worker`
+worker_cluster = None
+worker_session = None
+
+
+def init_export_worker(hosts, keyspace):
+    """Open own connection to the Cassandra cluster in the export worker process."""
+
+    global worker_cluster, worker_session
+
+    worker_cluster = Cluster(hosts)
+    worker_session = worker_cluster.connect(keyspace)
+
+    # close connection when the worker process exits
+    Finalize(worker_cluster, worker_cluster.shutdown, exitpriority=10)
+
+
+def export_range(task):
+    """
+    Export token range of the query table to the Parquet file in the worker process page by page.
+    Return number of exported rows.
+    """
+
+    table_name, token_range, filepath, fetch_size = task
+    table = next(table for table in QUERY_TABLES if table.name == table_name)
+
+    # all pages are written with the same schema, types inferred from the first page may not fit the others
+    schema = get_arrow_schema(worker_session, table.name, [column for column, _ in table.columns])
+
+    num_rows = 0
+    writer = None
+    for column_names, rows in read_pages(worker_session, get_range_query(table), token_range, fetch_size):
+        if not rows:
+            continue
+
+        batch = to_record_batch(column_names, rows, schema)
+        if writer is None:
+            writer = pq.ParquetWriter(filepath, schema)
+        writer.write_table(pa.Table.from_batches([batch]))
+        num_rows += len(rows)
+
+    if writer is not None:
+        writer.close()
+    return num_rows
+
+
+def export_table(hosts, keyspace, table_name, output_dir, splits=64, workers=os.cpu_count(), fetch_size=5000):
+    """
+    Export the whole query table to Parquet files, one file per non-empty token range.
+    Token ranges are exported by the pool of worker processes, each with its own connection to the cluster.
+    """
+
+    if pq is None:
+        raise ImportError('pyarrow is required to export tables to Parquet')
+
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(table_name, token_range, os.path.join(output_dir, 'part-{:05d}.parquet'.format(i)), fetch_size)
+             for i, token_range in enumerate(get_token_ranges(splits))]
+
+    num_rows = 0
+    with multiprocessing.Pool(workers, initializer=init_export_worker, initargs=(hosts, keyspace)) as pool:
+        for i, rows in enumerate(pool.imap_unordered(export_range, tasks), 1):
+            num_rows += rows
+            print('{}/{} token ranges exported.'.format(i, len(tasks)))
+
+        # let workers exit normally to close their connections
+        pool.close()
+        pool.join()
+
+    print('{} rows of {} are exported to {}'.format(num_rows, table_name, output_dir))
+    return num_rows
+
+
+def main():
+    """Export the query table to Parquet files with parallel token range scans."""
+
+    parser = argparse.ArgumentParser(description='Export the Cassandra query table to Parquet files.')
+    parser.add_argument('table', choices=[table.name for table in QUERY_TABLES], help='query table to export')
+    parser.add_argument('output', help='output directory')
+    parser.add_argument('--hosts', nargs='+', default=['127.0.0.1'], help='contact points of the Cassandra cluster')
+    parser.add_argument('--keyspace', default='sparkify', help='keyspace of the query table')
+    parser.add_argument('--splits', type=int, default=64, help='number of token ranges the table is split to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--fetch-size', type=int, default=5000, help='number of rows per page')
+    args = parser.parse_args()
+
+    export_table(args.hosts, args.keyspace, args.table, args.output, args.splits, args.workers, args.fetch_size)
+
+
+if __name__ == "__main__":
+    main()
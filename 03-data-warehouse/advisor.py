@@ -0,0 +1,504 @@
+import re
+import json
+import textwrap
+import argparse
+import itertools
+from collections import defaultdict
+import sql_queries
+
+# Estimated width in bytes of the values of each type, `(n)` types use their length up to the limit below.
+# Width of variable length values can be set in the statistics file.
+TYPE_WIDTHS = {
+    'smallint': 2, 'int': 4, 'integer': 4, 'bigint': 8, 'numeric': 8, 'decimal': 8, 'real': 4, 'float': 8,
+    'double precision': 8, 'boolean': 1, 'date': 4, 'timestamp': 8, 'timestamptz': 8, 'text': 32,
+}
+MAX_VARCHAR_WIDTH = 32
+
+# Column encodings recommended by Amazon Redshift for the types
+AZ64_TYPES = {'smallint', 'int', 'integer', 'bigint', 'numeric', 'decimal', 'date', 'timestamp', 'timestamptz'}
+RAW_TYPES = {'boolean', 'real', 'float', 'double precision'}
+BYTEDICT_MAX_DISTINCT = 256
+
+# Scores of the column usage to choose the sort key: range-restricted scans benefit most,
+# joins on the distribution key can be merge joins if the tables are sorted on it too.
+FILTER_SCORE = 4
+MERGE_JOIN_SCORE = 2
+GROUP_ORDER_SCORE = 1
+
+# Exhaustive search of the distribution styles is used up to this number of combinations
+MAX_COMBINATIONS = 200000
+
+KEYWORDS = {
+    'on', 'where', 'inner', 'left', 'right', 'full', 'outer', 'cross', 'join', 'group', 'order', 'limit', 'having',
+    'union', 'as', 'using', 'natural',
+}
+
+
+class Column:
+    """Column of the table DDL: name, type and the rest of the definition without distribution and sort keys."""
+
+    def __init__(self, name, column_type, constraints):
+        self.name = name
+        self.type = column_type
+        self.constraints = constraints
+
+    @property
+    def base_type(self):
+        return self.type.split('(')[0].strip()
+
+    def get_width(self):
+        """Return estimated width of the column values in bytes."""
+
+        match = re.match(r'(?:char|varchar|character varying|character)\s*\((\d+)\)', self.type)
+        if match:
+            return min(int(match.group(1)), MAX_VARCHAR_WIDTH)
+        return TYPE_WIDTHS.get(self.base_type, 8)
+
+
+class Table:
+    """Table parsed from the CREATE TABLE statement with its distribution style, distribution key and sort key."""
+
+    def __init__(self, name, columns, constraints=(), if_not_exists=False, diststyle=None, distkey=None, sortkey=()):
+        self.name = name
+        self.columns = columns
+        self.constraints = list(constraints)
+        self.if_not_exists = if_not_exists
+        self.diststyle = diststyle
+        self.distkey = distkey
+        self.sortkey = list(sortkey)
+
+    def get_column(self, name):
+        return next((column for column in self.columns if column.name == name), None)
+
+    @property
+    def distribution(self):
+        """Distribution of the table: ('KEY', column), ('ALL', None), ('EVEN', None) or (None, None) for AUTO."""
+
+        if self.distkey:
+            return 'KEY', self.distkey
+        return self.diststyle, None
+
+
+def split_top_level(text):
+    """Split text by commas which are not inside parentheses."""
+
+    parts = []
+    depth = 0
+    current = ''
+    for char in text:
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def parse_create_table(query):
+    """Parse CREATE TABLE statement of Amazon Redshift to the Table."""
+
+    match = re.match(r'\s*CREATE TABLE\s+(IF NOT EXISTS\s+)?([\w.]+)\s*\((.*)\)\s*(.*?);?\s*$', query,
+                     re.IGNORECASE | re.DOTALL)
+    if not match:
+        raise ValueError('Not a CREATE TABLE statement: {}'.format(query.strip()))
+
+    if_not_exists, name, body, attributes = match.groups()
+    table = Table(name, [], if_not_exists=bool(if_not_exists))
+
+    for definition in split_top_level(body):
+        if re.match(r'(PRIMARY KEY|FOREIGN KEY|UNIQUE|CONSTRAINT)\b', definition, re.IGNORECASE):
+            table.constraints.append(definition)
+            continue
+
+        column_match = re.match(r'(\w+)\s+(double precision|character varying|\w+(?:\s*\([\d\s,]+\))?)(.*)',
+                                definition, re.IGNORECASE | re.DOTALL)
+        column_name, column_type, rest = column_match.groups()
+        if re.search(r'\bSORTKEY\b', rest, re.IGNORECASE):
+            table.sortkey.append(column_name)
+        if re.search(r'\bDISTKEY\b', rest, re.IGNORECASE):
+            table.distkey = column_name
+        rest = re.sub(r'\b(SORTKEY|DISTKEY)\b|\bENCODE\s+\w+', '', rest, flags=re.IGNORECASE)
+        table.columns.append(Column(column_name, column_type.lower(), ' '.join(rest.split())))
+
+    diststyle = re.search(r'DISTSTYLE\s+(\w+)', attributes, re.IGNORECASE)
+    if diststyle:
+        table.diststyle = diststyle.group(1).upper()
+    distkey = re.search(r'DISTKEY\s*\(\s*(\w+)\s*\)', attributes, re.IGNORECASE)
+    if distkey:
+        table.distkey = distkey.group(1)
+    sortkey = re.search(r'SORTKEY\s*\(([^)]*)\)', attributes, re.IGNORECASE)
+    if sortkey:
+        table.sortkey = [column.strip() for column in sortkey.group(1).split(',')]
+
+    return table
+
+
+def build_create_table(table, distribution, sortkey, encodings):
+    """Return CREATE TABLE statement of the table with the given distribution, sort key and column encodings."""
+
+    definitions = []
+    for column in table.columns:
+        definition = ' '.join(part for part in (column.name, column.type, column.constraints) if part)
+        definitions.append('{} ENCODE {}'.format(definition, encodings[column.name]))
+    definitions.extend(table.constraints)
+
+    style, distkey = distribution
+    attributes = []
+    if style:
+        attributes.append('DISTSTYLE {}'.format(style))
+    if distkey:
+        attributes.append('DISTKEY({})'.format(distkey))
+    if sortkey:
+        attributes.append('SORTKEY({})'.format(', '.join(sortkey)))
+
+    return '\n    CREATE TABLE {}{}(\n        {}\n    ){};\n'.format(
+        'IF NOT EXISTS ' if table.if_not_exists else '', table.name, ',\n        '.join(definitions),
+        ''.join('\n    ' + attribute for attribute in attributes))
+
+
+def read_queries(filepath):
+    """Read analytic queries from the SQL file, queries are separated by semicolons and comments are removed."""
+
+    with open(filepath, encoding='utf8') as f:
+        text = re.sub(r'--[^\n]*', '', f.read())
+    return [query.strip() for query in text.split(';') if query.strip()]
+
+
+class QueryUsage:
+    """Tables, equi-joins and columns used for filtering, grouping and ordering in the analytic query."""
+
+    def __init__(self, query, tables):
+        # string literals are removed, so their content is not taken for column names
+        query = re.sub(r"'[^']*'", "''", query)
+        self.aliases = {}
+        for name, alias in re.findall(r'\b(?:FROM|JOIN)\s+([\w.]+)(?:\s+(?:AS\s+)?(\w+))?', query, re.IGNORECASE):
+            if name in tables:
+                if not alias or alias.lower() in KEYWORDS:
+                    alias = name
+                self.aliases[alias] = name
+                self.aliases.setdefault(name, name)
+        self.tables = tables
+
+        self.joins = []
+        join_refs = set()
+        for left, right in re.findall(r'([\w.]+)\s*=\s*([\w.]+)', query):
+            left_column, right_column = self.resolve(left), self.resolve(right)
+            if left_column and right_column and left_column[0] != right_column[0]:
+                self.joins.append((left_column, right_column))
+                join_refs.update((left_column, right_column))
+
+        where = self.get_clause(query, 'WHERE', ('GROUP BY', 'ORDER BY', 'HAVING', 'LIMIT'))
+        self.filters = [column for column in self.get_columns(where) if column not in join_refs]
+        group_order = (self.get_clause(query, 'GROUP BY', ('HAVING', 'ORDER BY', 'LIMIT')) + ' ' +
+                       self.get_clause(query, 'ORDER BY', ('LIMIT',)))
+        self.group_order = self.get_columns(group_order)
+
+    @staticmethod
+    def get_clause(query, start, ends):
+        """Return text of the clause between its keyword and the first of the following clause keywords."""
+
+        match = re.search(r'\b{}\b(.*?)(?:\b(?:{})\b|$)'.format(start, '|'.join(ends)), query,
+                          re.IGNORECASE | re.DOTALL)
+        return match.group(1) if match else ''
+
+    def resolve(self, reference):
+        """Return (table, column) of the qualified or unqualified column reference or None."""
+
+        if '.' in reference:
+            alias, column = reference.rsplit('.', 1)
+            table = self.aliases.get(alias)
+            if table and self.tables[table].get_column(column):
+                return table, column
+            return None
+
+        owners = {table for table in self.aliases.values() if self.tables[table].get_column(reference)}
+        if len(owners) == 1:
+            return owners.pop(), reference
+        return None
+
+    def get_columns(self, text):
+        """Return list of distinct (table, column) referenced in the text."""
+
+        columns = []
+        for reference in re.findall(r'\b[\w.]+\b', text):
+            column = self.resolve(reference)
+            if column and column not in columns:
+                columns.append(column)
+        return columns
+
+
+class Workload:
+    """Tables with statistics and analytic queries, estimates data movement of the joins for distribution styles."""
+
+    def __init__(self, tables, stats, queries, nodes=4, slices=8):
+        self.tables = tables
+        self.stats = stats
+        self.nodes = nodes
+        self.slices = slices
+        self.usages = [QueryUsage(query, tables) for query in queries]
+
+    def get_rows(self, table):
+        return self.stats.get(table, {}).get('rows')
+
+    def get_distinct(self, table, column):
+        return self.stats.get(table, {}).get('columns', {}).get(column, {}).get('distinct')
+
+    def get_size(self, table):
+        """Return estimated size of the table in bytes: rows multiplied by the width of the row."""
+
+        columns = self.stats.get(table, {}).get('columns', {})
+        width = sum(columns.get(column.name, {}).get('width', column.get_width())
+                    for column in self.tables[table].columns)
+        return (self.get_rows(table) or 0) * width
+
+    def get_join_cost(self, left, right, distributions):
+        """
+        Return estimated number of bytes moved between nodes to join two tables:
+        - nothing if both tables are distributed on the join columns or one of them is distributed to all nodes;
+        - the other table is redistributed if one table is distributed on its join column;
+        - otherwise both tables are redistributed or the smaller table is broadcast, whichever is cheaper.
+        """
+
+        (left_table, left_column), (right_table, right_column) = left, right
+        left_distribution, right_distribution = distributions[left_table], distributions[right_table]
+        if left_distribution[0] == 'ALL' or right_distribution[0] == 'ALL':
+            return 0
+
+        left_size, right_size = self.get_size(left_table), self.get_size(right_table)
+        left_key = left_distribution == ('KEY', left_column)
+        right_key = right_distribution == ('KEY', right_column)
+        if left_key and right_key:
+            return 0
+        if left_key:
+            return right_size
+        if right_key:
+            return left_size
+        return min(left_size + right_size, min(left_size, right_size) * self.nodes)
+
+    def get_joins_cost(self, distributions):
+        """Return estimated bytes moved by the joins of all queries."""
+
+        return sum(self.get_join_cost(left, right, distributions)
+                   for usage in self.usages for left, right in usage.joins)
+
+    def get_replication_cost(self, table, distribution):
+        """Return bytes copied to the other nodes on every load of the table distributed to all nodes."""
+
+        return self.get_size(table) * (self.nodes - 1) if distribution[0] == 'ALL' else 0
+
+    def get_cost(self, distributions):
+        return self.get_joins_cost(distributions) + sum(
+            self.get_replication_cost(table, distribution) for table, distribution in distributions.items())
+
+    def get_candidates(self, table):
+        """
+        Return candidate distributions of the table: EVEN, ALL and KEY on every join column of the table.
+        Columns with fewer distinct values than slices are skipped, they would put all rows to a few slices.
+        """
+
+        candidates = [('EVEN', None), ('ALL', None)]
+        for usage in self.usages:
+            for left, right in usage.joins:
+                for join_table, column in (left, right):
+                    distinct = self.get_distinct(join_table, column)
+                    if (join_table == table and ('KEY', column) not in candidates
+                            and (distinct is None or distinct >= self.slices)):
+                        candidates.append(('KEY', column))
+        return candidates
+
+    def advise_distributions(self):
+        """
+        Return distribution of every table with statistics which minimizes bytes moved by the joins of the queries
+        and copied by ALL distribution. Tables without statistics keep their current distribution.
+        """
+
+        distributions = {name: table.distribution for name, table in self.tables.items()}
+        names = [name for name in self.tables if self.get_rows(name) is not None]
+        candidates = {name: self.get_candidates(name) for name in names}
+
+        combinations = 1
+        for name in names:
+            combinations *= len(candidates[name])
+
+        if combinations <= MAX_COMBINATIONS:
+            best = None
+            for choice in itertools.product(*(candidates[name] for name in names)):
+                distributions.update(zip(names, choice))
+                cost = self.get_cost(distributions)
+                if best is None or cost < best[0]:
+                    best = (cost, dict(distributions))
+            return best[1]
+
+        # too many tables for the exhaustive search, improve one table at a time until nothing changes
+        changed = True
+        while changed:
+            changed = False
+            for name in names:
+                current = self.get_cost(distributions)
+                for candidate in candidates[name]:
+                    previous = distributions[name]
+                    distributions[name] = candidate
+                    if self.get_cost(distributions) < current:
+                        current = self.get_cost(distributions)
+                        changed = True
+                    else:
+                        distributions[name] = previous
+        return distributions
+
+    def advise_sortkey(self, table, distribution):
+        """
+        Return sort key of the table: columns used in the filters of the queries ordered by usage,
+        or the most used join (only if it is the distribution key), grouping or ordering column.
+        """
+
+        scores = defaultdict(int)
+        filters = defaultdict(int)
+        for usage in self.usages:
+            for filter_table, column in usage.filters:
+                if filter_table == table:
+                    scores[column] += FILTER_SCORE
+                    filters[column] += 1
+            for left, right in usage.joins:
+                for join_table, column in (left, right):
+                    if join_table == table and distribution == ('KEY', column):
+                        scores[column] += MERGE_JOIN_SCORE
+            for group_table, column in usage.group_order:
+                if group_table == table:
+                    scores[column] += GROUP_ORDER_SCORE
+
+        # ties are resolved by the order of the columns in the table
+        order = [column.name for column in self.tables[table].columns]
+        if filters:
+            return sorted(filters, key=lambda column: (-scores[column], order.index(column)))[:2]
+        if scores:
+            return [min(scores, key=lambda column: (-scores[column], order.index(column)))]
+        return []
+
+    def advise_encodings(self, table, sortkey):
+        """
+        Return encoding of every column: RAW for the leading sort key column, AZ64 for numbers and timestamps,
+        BYTEDICT for strings with few distinct values and ZSTD for other strings.
+        """
+
+        encodings = {}
+        for column in self.tables[table].columns:
+            distinct = self.get_distinct(table, column.name)
+            if sortkey and column.name == sortkey[0] or column.base_type in RAW_TYPES:
+                encodings[column.name] = 'RAW'
+            elif column.base_type in AZ64_TYPES:
+                encodings[column.name] = 'AZ64'
+            elif distinct is not None and distinct < BYTEDICT_MAX_DISTINCT:
+                encodings[column.name] = 'BYTEDICT'
+            else:
+                encodings[column.name] = 'ZSTD'
+        return encodings
+
+
+def format_distribution(distribution):
+    style, column = distribution
+    if style == 'KEY':
+        return 'KEY({})'.format(column)
+    return style or 'AUTO'
+
+
+def report(workload, distributions):
+    """Print current and advised distribution of the tables and estimated data movement of the joins."""
+
+    current = {name: table.distribution for name, table in workload.tables.items()}
+    print('{:<20} {:>12} {:>24} {:>24}'.format('table', 'rows', 'current', 'advised'))
+    for name, table in workload.tables.items():
+        rows = workload.get_rows(name)
+        print('{:<20} {:>12} {:>24} {:>24}'.format(
+            name, '-' if rows is None else rows, format_distribution(current[name]),
+            format_distribution(distributions[name])))
+
+    print('Estimated bytes moved by the joins:')
+    for usage in workload.usages:
+        for left, right in usage.joins:
+            print('    {}.{} = {}.{}: current {}, advised {}'.format(
+                *left, *right, workload.get_join_cost(left, right, current),
+                workload.get_join_cost(left, right, distributions)))
+
+    for title, config in (('current', current), ('advised', distributions)):
+        replication = sum(workload.get_replication_cost(name, distribution) for name, distribution in config.items())
+        print('Total {}: {} bytes moved by the joins, {} bytes replicated by DISTSTYLE ALL.'.format(
+            title, workload.get_joins_cost(config), replication))
+
+
+def get_query_names(queries):
+    """Return names of the variables of `sql_queries.py` which hold the given queries."""
+
+    names = {id(value): name for name, value in vars(sql_queries).items() if isinstance(value, str)}
+    return [names.get(id(query), 'table_create_{}'.format(i)) for i, query in enumerate(queries)]
+
+
+def load_stats(filepath, rows):
+    """
+    Load table statistics from the JSON file: {"table": {"rows": 100, "columns": {"column": {"distinct": 10,
+    "width": 20}}}}. Row counts can be overridden with `table=rows` strings.
+    """
+
+    stats = {}
+    if filepath:
+        with open(filepath, encoding='utf8') as f:
+            stats = json.load(f)
+    for item in rows or []:
+        table, count = item.split('=')
+        stats.setdefault(table, {})['rows'] = int(count)
+    return stats
+
+
+def main():
+    """Recommend distribution styles, sort keys and encodings of the tables and print revised CREATE statements."""
+
+    parser = argparse.ArgumentParser(
+        description='Recommend DISTKEY, SORTKEY and ENCODE settings of the DWH tables from the analytic queries.')
+    parser.add_argument('--queries', default='analytic_queries.sql', help='SQL file with the analytic queries')
+    parser.add_argument('--stats', default=None, help='JSON file with row counts and column statistics')
+    parser.add_argument('--rows', nargs='*', metavar='TABLE=ROWS', help='row counts of the tables')
+    parser.add_argument('--nodes', type=int, default=4, help='number of nodes in the cluster')
+    parser.add_argument('--slices', type=int, default=8, help='number of slices in the cluster')
+    parser.add_argument('--output', default=None, help='file to write revised create_table_queries to')
+    args = parser.parse_args()
+
+    queries = sql_queries.create_table_queries
+    tables = {}
+    for query in queries:
+        table = parse_create_table(query)
+        tables[table.name] = table
+
+    stats = load_stats(args.stats, args.rows)
+    if not stats:
+        parser.error('row counts of the tables are required, use --stats or --rows')
+
+    workload = Workload(tables, stats, read_queries(args.queries), args.nodes, args.slices)
+    distributions = workload.advise_distributions()
+    report(workload, distributions)
+
+    names = get_query_names(queries)
+    lines = ['# CREATE TABLES', '']
+    for name, table in zip(names, tables.values()):
+        if workload.get_rows(table.name) is None:
+            create = '\n' + queries[names.index(name)].strip('\n') + '\n'
+        else:
+            sortkey = workload.advise_sortkey(table.name, distributions[table.name])
+            create = build_create_table(table, distributions[table.name], sortkey,
+                                        workload.advise_encodings(table.name, sortkey))
+        lines.extend(['{} = ("""{}""")'.format(name, create), ''])
+    lines.append(textwrap.fill('create_table_queries = [{}]'.format(', '.join(names)), width=120,
+                               subsequent_indent=' ' * len('create_table_queries = [')))
+
+    output = '\n'.join(lines) + '\n'
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            f.write(output)
+        print('Revised create_table_queries are written to {}'.format(args.output))
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
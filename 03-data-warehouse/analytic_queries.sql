@@ -0,0 +1,24 @@
+-- Log of analytic queries used by `advisor.py` to recommend distribution and sort keys.
+-- Every query is counted once, so repeat frequent queries or append a query log exported from the cluster.
+
+-- Top 10 most popular songs (dashboard.ipynb)
+SELECT s.title as song
+    , a.name as artist
+    , COUNT(*) as play_count
+FROM songplays sp
+INNER JOIN songs s ON s.song_id = sp.song_id
+LEFT JOIN artists a ON a.artist_id = sp.artist_id
+GROUP BY s.title, a.name
+ORDER BY play_count DESC
+LIMIT 10;
+
+-- Weekly statistics (dashboard.ipynb)
+SELECT t.year
+    , t.month
+    , t.week
+    , COUNT(*) as song_count
+    , COUNT(DISTINCT sp.user_id) as user_count
+FROM songplays sp
+INNER JOIN time t ON t.start_time = sp.start_time
+GROUP BY t.year, t.month, t.week
+ORDER BY t.year ASC, t.month, t.week ASC;
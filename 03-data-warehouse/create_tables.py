@@ -20,7 +20,7 @@ def create_schemas(cur, conn):
             cur.execute(query)
             conn.commit()
         except psycopg2.Error as e:
-            print('Error occurred during execution of query: "%r". Error: "%r"' % query, e)
+            print('Error occurred during execution of query: "%r". Error: "%r"' % (query, e))
     print('Done.')
 
 
@@ -33,7 +33,7 @@ def drop_tables(cur, conn):
             cur.execute(query)
             conn.commit()
         except psycopg2.Error as e:
-            print('Error occurred during execution of query: "%r". Error: "%r"' % query, e)
+            print('Error occurred during execution of query: "%r". Error: "%r"' % (query, e))
     print('Done.')
 
 
@@ -46,7 +46,7 @@ def create_tables(cur, conn):
             cur.execute(query)
             conn.commit()
         except psycopg2.Error as e:
-            print('Error occurred during execution of query: "%r". Error: "%r"' % query, e)
+            print('Error occurred during execution of query: "%r". Error: "%r"' % (query, e))
     print('Done.')
 
 
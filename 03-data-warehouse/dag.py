@@ -0,0 +1,144 @@
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Step:
+    """SQL statement of the ETL pipeline and names of the steps which have to be finished before it starts."""
+
+    def __init__(self, name, query, depends_on=()):
+        self.name = name
+        self.query = query
+        self.depends_on = list(depends_on)
+
+
+def sort_steps(steps):
+    """Return steps in topological order, raise ValueError for unknown dependencies and cycles."""
+
+    names = {step.name for step in steps}
+    for step in steps:
+        unknown = set(step.depends_on) - names
+        if unknown:
+            raise ValueError('Step {} depends on unknown steps: {}'.format(step.name, ', '.join(sorted(unknown))))
+
+    ordered = []
+    done = set()
+    remaining = list(steps)
+    while remaining:
+        ready = [step for step in remaining if set(step.depends_on) <= done]
+        if not ready:
+            raise ValueError('Steps have cyclic dependencies: {}'.format(', '.join(step.name for step in remaining)))
+        ordered.extend(ready)
+        done.update(step.name for step in ready)
+        remaining = [step for step in remaining if step.name not in done]
+
+    return ordered
+
+
+class ConnectionPool:
+    """Fixed number of open connections, every connection is used by a single step at a time."""
+
+    def __init__(self, connect, size):
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(connect())
+
+    def acquire(self):
+        return self.connections.get()
+
+    def release(self, conn):
+        self.connections.put(conn)
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get().close()
+
+
+def execute_step(pool, step, metrics=None):
+    """
+        Execute and commit the statement of the step on a pooled connection, return its duration in seconds.
+        Metrics of the statement are recorded if `metrics` is given.
+        The transaction is rolled back on any error, so the connection is returned to the pool usable.
+    """
+
+    conn = pool.acquire()
+    try:
+        start = time.perf_counter()
+        cur = conn.cursor()
+        if metrics is not None:
+            metrics.execute(cur, step.name, step.query)
+        else:
+            cur.execute(step.query)
+        conn.commit()
+        cur.close()
+        return time.perf_counter() - start
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.release(conn)
+
+
+def report(timings, failed, wall_time):
+    """Print start and duration of every step and wall-clock savings versus the serial execution."""
+
+    print('{:<30} {:>10} {:>10}'.format('step', 'start, s', 'time, s'))
+    for name, (start, duration) in sorted(timings.items(), key=lambda item: item[1][0]):
+        print('{:<30} {:>10.2f} {:>10.2f}'.format(name, start, duration))
+    for name in failed:
+        print('{:<30} {:>10} {:>10}'.format(name, '-', 'failed' if failed[name] else 'skipped'))
+
+    # durations of concurrent steps include waiting for shared cluster resources,
+    # so their sum is an upper estimate of the serial execution
+    serial_time = sum(duration for _, duration in timings.values())
+    saved = serial_time - wall_time
+    print('Wall-clock time {:.2f} s, serial time {:.2f} s, saved {:.2f} s ({:.0%}).'.format(
+        wall_time, serial_time, saved, saved / serial_time if serial_time else 0))
+
+
+def run_steps(steps, connect, workers=4, metrics=None):
+    """
+        Execute steps on a pool of `workers` connections, every step starts as soon as all its dependencies are
+        finished. Each step is committed separately. Any exception raised by a step fails this step only
+        and steps which depend on a failed step are skipped.
+        Return True if all steps are executed successfully.
+    """
+
+    steps = sort_steps(steps)
+    pool = ConnectionPool(connect, workers)
+    pending = list(steps)
+    done = set()
+    # failed and skipped steps, value is True for failed ones
+    failed = {}
+    timings = {}
+    running = {}
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(workers) as executor:
+        while pending or running:
+            # pending steps are in topological order, so skipped steps are propagated in a single pass
+            for step in list(pending):
+                if any(name in failed for name in step.depends_on):
+                    failed[step.name] = False
+                    pending.remove(step)
+                elif set(step.depends_on) <= done:
+                    running[executor.submit(execute_step, pool, step, metrics)] = (step, time.perf_counter() - started)
+                    pending.remove(step)
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step, start = running.pop(future)
+                try:
+                    timings[step.name] = (start, future.result())
+                    done.add(step.name)
+                    print('Step {} is done.'.format(step.name))
+                except Exception as e:
+                    failed[step.name] = True
+                    print('Error occurred during execution of step {}: "{!r}"'.format(step.name, e))
+
+    pool.close()
+    report(timings, failed, time.perf_counter() - started)
+    return not failed
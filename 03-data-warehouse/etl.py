@@ -1,40 +1,165 @@
+import argparse
+import posixpath
+import functools
 import configparser
 import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
+from dag import Step, run_steps
+from run_metrics import RunMetrics
+from sql_queries import (staging_truncate_queries, merge_table_steps, watermark_select, watermark_update,
+                         staging_events_trim, copy_table_steps, insert_table_steps)
 
 
-def load_staging_tables(cur, conn):
+def positive_int(value):
+    """Parse command line argument which has to be a positive integer."""
+
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('{} is not a positive integer'.format(value))
+    return number
+
+
+def execute_steps(cur, conn, steps, metrics):
+    """
+        Execute and commit statements one by one, metrics of every statement are recorded.
+        Failed statement is rolled back and reported, the following statements are still executed.
+        Return True if all statements are executed successfully.
+    """
+
+    success = True
+    for name, query, _ in steps:
+        try:
+            metrics.execute(cur, name, query)
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            success = False
+            print('Error occurred during execution of query {}: "{!r}". Error: "{!r}"'.format(name, query, e))
+
+    return success
+
+
+def load_staging_tables(cur, conn, metrics):
     """
         Load raw data from source to staging tables in DWH (Amazon Redshift).
         Raw data stored in the Amazon S3 storage in JSON format.
+        Small source files are coalesced to gzip chunks by `prepare_staging.py` beforehand,
+        chunks are loaded with manifest COPY and columns are extracted with explicit JSONPaths.
 
         JSON files are processed and copy into two staging tables:
         - `staging.songs` with metadata about songs and artists.
         - `staging.events` with raw events from Sparkify service with information about user activity.
+
+        Return True if all staging tables are loaded successfully.
     """
     print('ETL step 1. Copy raw data from Amazon S3 to Amazon Redshift staging tables...')
-    for query in copy_table_queries:
-        try:
-            cur.execute(query)
-            conn.commit()
-        except psycopg2.Error as e:
-            print('Error occurred during execution of query: "%r". Error: "%r"' % query, e)
+    success = execute_steps(cur, conn, copy_table_steps, metrics)
     print('Done.')
+    return success
 
 
-def insert_tables(cur, conn):
+def insert_tables(cur, conn, metrics):
     """
         Load data from staging tables to dimension and fact tables.
         This step includes data quality checks.
+        Return True if all tables are loaded successfully.
     """
 
     print('ETL step 2. Load data from staging tables to dimension and fact tables...')
-    for query in insert_table_queries:
-        try:
-            cur.execute(query)
-            conn.commit()
-        except psycopg2.Error as e:
-            print('Error occurred during execution of query: "%r". Error: "%r"' % query, e)
+    success = execute_steps(cur, conn, insert_table_steps, metrics)
+    print('Done.')
+    return success
+
+
+def load_tables_parallel(connect, workers, metrics):
+    """
+        Run both steps of the ETL pipeline as a graph of statements on a pool of `workers` connections.
+        Staging tables are copied concurrently and every dimension and fact table is loaded as soon as
+        the staging tables it reads are copied, independent tables are loaded concurrently.
+        Return True if all statements are executed successfully.
+    """
+
+    print('ETL steps 1 and 2. Copy raw data to staging tables and load dimension and fact tables '
+          'with {} connections...'.format(workers))
+    steps = [Step(*step) for step in copy_table_steps + insert_table_steps]
+    return run_steps(steps, connect, workers, metrics)
+
+
+def get_watermark(cur, source='events'):
+    """
+        Return high-water mark of the source: maximum `ts` of the events loaded to the star schema for `events`,
+        maximum modification time of the loaded song files in milliseconds for `songs`.
+    """
+
+    cur.execute(watermark_select, (source,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def get_prepare_command(config, watermark, songs_watermark):
+    """Return `prepare_staging.py` command which stages only events and song files newer than the high-water marks."""
+
+    url_prefix = posixpath.dirname(config.get('STAGING', 'EVENTS_MANIFEST').strip("'"))
+    return 'python prepare_staging.py --min-ts {} --songs-since {} --url-prefix {}'.format(
+        watermark, songs_watermark, url_prefix)
+
+
+def update_watermark(cur, conn, watermark, songs_watermark, metrics):
+    """
+        Move high-water marks of the `events` and `songs` sources to the maximum `ts` of the staged events
+        and the maximum modification time of the staged song files, given values are kept if nothing is staged.
+    """
+
+    metrics.execute(cur, 'watermark_update', watermark_update, (watermark, songs_watermark))
+    conn.commit()
+
+
+def get_staged_events(cur):
+    """Return number of events in the staging table."""
+
+    cur.execute('SELECT COUNT(*) FROM stg.events;')
+    return cur.fetchone()[0]
+
+
+def load_staging_delta(cur, conn, watermark, metrics):
+    """
+        Load new raw data to the empty staging tables for the incremental load.
+        Staging tables are truncated before COPY and events which are not newer than the high-water mark are removed
+        after it, so only the delta is merged to the star schema.
+        Return False if any staging table is not loaded, partial delta must not be merged.
+    """
+
+    print('ETL step 1. Copy new raw data from Amazon S3 to Amazon Redshift staging tables...')
+    for query in staging_truncate_queries:
+        cur.execute(query)
+        conn.commit()
+
+    if not load_staging_tables(cur, conn, metrics):
+        return False
+
+    metrics.execute(cur, 'staging_events_trim', staging_events_trim, (watermark,))
+    conn.commit()
+    print('{} new events are staged.'.format(get_staged_events(cur)))
+    return True
+
+
+def merge_tables(cur, conn, watermark, songs_watermark, metrics):
+    """
+        Merge staged delta to dimension and fact tables in a single transaction:
+        `songplays` and `time` with delete-then-insert on natural keys, `users`, `songs` and `artists` with upsert
+        of new and changed rows only. High-water marks are moved in the same transaction,
+        so failed merge can be simply restarted.
+    """
+
+    print('ETL step 2. Merge new data from staging tables to dimension and fact tables...')
+    try:
+        for name, query in merge_table_steps:
+            metrics.execute(cur, name, query)
+        metrics.execute(cur, 'watermark_update', watermark_update, (watermark, songs_watermark))
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print('Error occurred during merge, all changes are rolled back. Error: "%r"' % e)
+        raise
     print('Done.')
 
 
@@ -43,19 +168,63 @@ def main():
         Connect to Amazon Redshift cluster and process raw data from source in two steps:
         - Load raw data in JSON format from Amazon S3 to staging tables in the DWH (Amazon Redshift).
         - Load data from staging tables to dimension and fact tables in the DWH (include data quality checks).
+
+        With `--workers` independent statements of the full load are executed concurrently.
+        With `--incremental` only events and song files newer than the high-water marks are staged and merged
+        to the existing tables, so the cost of the refresh depends on the delta instead of the whole history.
+
+        Duration and number of affected rows of every statement (and the query plan with `--explain`) are saved
+        to the `etl_run_metrics` table, use `run_metrics.py` to compare the run with the previous ones.
     """
 
+    parser = argparse.ArgumentParser(description='Load Sparkify data to the Amazon Redshift DWH.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='merge events newer than the high-water mark instead of the full load')
+    parser.add_argument('--workers', type=positive_int, default=1,
+                        help='number of connections to run independent statements of the full load concurrently')
+    parser.add_argument('--explain', action='store_true', help='save query plans of the statements to the metrics')
+    args = parser.parse_args()
+
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
     try:
-        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+        dsn = "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values())
+        conn = psycopg2.connect(dsn)
         cur = conn.cursor()
     except psycopg2.Error as e:
         print('Could not connect to the Amazon Redshift cluster. Error: "%r"' % e)
+        return
 
-    load_staging_tables(cur, conn)
-    insert_tables(cur, conn)
+    metrics = RunMetrics(explain=args.explain)
+    print('ETL run {}.'.format(metrics.run_id))
+    try:
+        if args.incremental:
+            watermark = get_watermark(cur)
+            songs_watermark = get_watermark(cur, 'songs')
+            print('High-water marks: events ts = {}, songs modified at {}'.format(watermark, songs_watermark))
+            print('Only data staged with "{}" is expected, older events are removed from the staging table.'
+                  .format(get_prepare_command(config, watermark, songs_watermark)))
+            if load_staging_delta(cur, conn, watermark, metrics):
+                merge_tables(cur, conn, watermark, songs_watermark, metrics)
+            else:
+                print('Staging tables are not loaded, the merge is skipped and the high-water mark is kept.')
+        elif args.workers > 1:
+            if load_tables_parallel(functools.partial(psycopg2.connect, dsn), args.workers, metrics):
+                update_watermark(cur, conn, 0, 0, metrics)
+        else:
+            # inserts are executed even if some COPY failed, but the high-water mark is moved only after a full load
+            staged = load_staging_tables(cur, conn, metrics)
+            if insert_tables(cur, conn, metrics) and staged:
+                update_watermark(cur, conn, 0, 0, metrics)
+    finally:
+        # metrics of the executed statements are kept even if the run failed
+        metrics.save(cur, conn)
+    watermark = get_watermark(cur)
+    songs_watermark = get_watermark(cur, 'songs')
+    print('New high-water marks: events ts = {}, songs modified at {}'.format(watermark, songs_watermark))
+    print('Stage new data for the next incremental run with "{}".'.format(
+        get_prepare_command(config, watermark, songs_watermark)))
 
     conn.close()
     print('All data was processed! ETL pipeline was successfully finished!')
@@ -0,0 +1,291 @@
+import os
+import io
+import csv
+import glob
+import gzip
+import json
+import heapq
+import argparse
+
+# Columns of the staging tables and their JSONPaths in the source JSON objects.
+# Order of the JSONPaths must be the same as the order of the columns in the staging tables.
+STAGING_SOURCES = {
+    'events': ('stg.events', [
+        'artist', 'auth', 'firstName', 'gender', 'itemInSession', 'lastName', 'length', 'level', 'location', 'method',
+        'page', 'registration', 'sessionId', 'song', 'status', 'ts', 'userAgent', 'userId',
+    ]),
+    'songs': ('stg.songs', [
+        'num_songs', 'artist_id', 'artist_latitude', 'artist_longitude', 'artist_location', 'artist_name', 'song_id',
+        'title', 'duration', 'year', 'source_mtime',
+    ]),
+}
+
+# Amazon Redshift recommends compressed files of 1 MB - 1 GB, source files are coalesced to chunks of about this size
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def get_mtime(filepath):
+    """Return modification time of the file in milliseconds since the epoch, the same unit as `ts` of the events."""
+
+    return int(os.path.getmtime(filepath) * 1000)
+
+
+def get_files(filepath, min_mtime=None):
+    """
+    Return sorted list of all JSON files in the directory and its subdirectories.
+    With `min_mtime` only files modified at or after it are returned, older files are not even opened.
+    """
+
+    all_files = []
+    for root, dirs, files in os.walk(filepath):
+        all_files.extend(glob.glob(os.path.join(root, '*.json')))
+
+    return sorted(path for path in all_files if min_mtime is None or get_mtime(path) >= min_mtime)
+
+
+def get_num_chunks(total_size, num_files, slices, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Return number of chunks for the data of the given size: multiple of the number of slices in the cluster,
+    so every slice loads the same number of files, and chunks are not larger than `chunk_size` if possible.
+    There are no more chunks than files, so no chunk is empty: the number of chunks is rounded down
+    to a multiple of the slices to fit the number of files. Inputs with fewer files than slices are exempt
+    and get one chunk per file.
+    """
+
+    if num_files < slices:
+        return max(1, num_files)
+
+    per_slice = max(1, -(-total_size // (slices * chunk_size)))
+    return slices * min(per_slice, num_files // slices)
+
+
+def split_files(sizes, num_chunks):
+    """
+    Split files given as {path: size} to the given number of chunks of about the same size.
+    Largest files are assigned first, every file goes to the smallest chunk so far.
+    """
+
+    chunks = [(0, i, []) for i in range(num_chunks)]
+    for size, filepath in sorted(((size, filepath) for filepath, size in sizes.items()), reverse=True):
+        chunk_size, i, chunk_files = heapq.heappop(chunks)
+        chunk_files.append(filepath)
+        heapq.heappush(chunks, (chunk_size + size, i, chunk_files))
+
+    return [sorted(chunk_files) for _, _, chunk_files in sorted(chunks, key=lambda chunk: chunk[1])]
+
+
+def read_objects(filepath):
+    """
+    Yield JSON objects of the source file. Log files contain one object per line and song files contain
+    a single object, so objects are decoded one after another regardless of line breaks.
+    """
+
+    decoder = json.JSONDecoder()
+    with open(filepath, encoding='utf8') as f:
+        text = f.read()
+
+    pos = 0
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos == len(text):
+            return
+        obj, pos = decoder.raw_decode(text, pos)
+        yield obj
+
+
+def is_staged(obj, min_ts=None):
+    """Return True if the object is written to the chunk: with `min_ts` only events newer than it are staged."""
+
+    return min_ts is None or obj['ts'] > min_ts
+
+
+def get_staged_sizes(files, min_ts=None):
+    """
+    Return {path: size} of the files with the number of bytes they add to the chunks.
+    Without `min_ts` it is the size of the file, otherwise the size of the newer events as they are written
+    to the chunk and files without newer events are left out, so chunks are balanced by the staged data.
+    """
+
+    if min_ts is None:
+        return {filepath: os.path.getsize(filepath) for filepath in files}
+
+    sizes = {}
+    for filepath in files:
+        size = sum(len(json.dumps(obj)) + 1 for obj in read_objects(filepath) if is_staged(obj, min_ts))
+        if size:
+            sizes[filepath] = size
+    return sizes
+
+
+def write_chunk(files, filepath, min_ts=None, with_mtime=False):
+    """
+    Write objects of all files to the gzip-compressed chunk, one object per line. Return number of objects.
+    With `min_ts` only events newer than it are written. With `with_mtime` modification time of the source file
+    is added to every object as `source_mtime`.
+    """
+
+    num_objects = 0
+    with gzip.open(filepath, 'wt', encoding='utf8') as f:
+        for source in files:
+            mtime = get_mtime(source)
+            for obj in read_objects(source):
+                if not is_staged(obj, min_ts):
+                    continue
+                if with_mtime:
+                    obj['source_mtime'] = mtime
+                f.write(json.dumps(obj))
+                f.write('\n')
+                num_objects += 1
+
+    return num_objects
+
+
+def write_manifest(chunk_paths, url_prefix, filepath):
+    """
+    Write COPY manifest which lists all chunks as mandatory entries.
+    With `url_prefix` (e.g. S3 location the chunks are uploaded to) URLs are built from it and the chunk file names,
+    otherwise local paths of the chunks are used.
+    """
+
+    entries = []
+    for chunk_path in chunk_paths:
+        if url_prefix:
+            url = url_prefix.rstrip('/') + '/' + os.path.basename(chunk_path)
+        else:
+            url = os.path.abspath(chunk_path)
+        entries.append({'url': url, 'mandatory': True, 'meta': {'content_length': os.path.getsize(chunk_path)}})
+
+    with open(filepath, 'w', encoding='utf8') as f:
+        json.dump({'entries': entries}, f, indent=2)
+
+
+def write_jsonpaths(columns, filepath):
+    """Write JSONPaths file which maps fields of the source objects to the columns of the staging table."""
+
+    with open(filepath, 'w', encoding='utf8') as f:
+        json.dump({'jsonpaths': ["$['{}']".format(column) for column in columns]}, f, indent=2)
+
+
+def prepare_source(source, input_dir, output_dir, slices, chunk_size=DEFAULT_CHUNK_SIZE, url_prefix=None,
+                   min_ts=None, min_mtime=None):
+    """
+    Coalesce small JSON files of the source to evenly sized gzip chunks and write manifest and JSONPaths for COPY.
+    Chunks are written to `<output_dir>/<source>/`, manifest and JSONPaths to `<output_dir>/<source>.manifest`
+    and `<output_dir>/<source>_jsonpath.json`. Return path of the manifest.
+    With `min_ts` (high-water mark of the incremental load) only newer events are staged, number of chunks
+    and their sizes are computed from the staged events only, see `get_num_chunks`.
+    With `min_mtime` files modified before it are skipped without parsing.
+    """
+
+    _, columns = STAGING_SOURCES[source]
+    files = get_files(input_dir, min_mtime)
+    sizes = get_staged_sizes(files, min_ts)
+    total_size = sum(sizes.values())
+    num_chunks = get_num_chunks(total_size, len(sizes), slices, chunk_size)
+
+    chunk_dir = os.path.join(output_dir, source)
+    os.makedirs(chunk_dir, exist_ok=True)
+    for filepath in glob.glob(os.path.join(chunk_dir, 'part-*.json.gz')):
+        os.remove(filepath)
+
+    chunk_paths = []
+    num_objects = 0
+    for i, chunk_files in enumerate(split_files(sizes, num_chunks)):
+        chunk_path = os.path.join(chunk_dir, 'part-{:05d}.json.gz'.format(i))
+        num_objects += write_chunk(chunk_files, chunk_path, min_ts, 'source_mtime' in columns)
+        chunk_paths.append(chunk_path)
+
+    manifest_path = os.path.join(output_dir, '{}.manifest'.format(source))
+    write_manifest(chunk_paths, url_prefix and url_prefix.rstrip('/') + '/' + source, manifest_path)
+    write_jsonpaths(columns, os.path.join(output_dir, '{}_jsonpath.json'.format(source)))
+
+    print('{}: {} objects from {} files ({} bytes) are coalesced to {} chunks for {} slices.'.format(
+        source, num_objects, len(sizes), total_size, num_chunks, slices))
+    return manifest_path
+
+
+def read_manifest(filepath):
+    """Return URLs of all entries of the COPY manifest."""
+
+    with open(filepath, encoding='utf8') as f:
+        return [entry['url'] for entry in json.load(f)['entries']]
+
+
+def copy_local(cur, conn, source, manifest_path):
+    """
+    Local PostgreSQL stand-in for the manifest COPY of Amazon Redshift: read every chunk of the manifest,
+    extract columns of the staging table from the objects and load them with COPY FROM STDIN.
+    Missing fields are written as empty unquoted CSV fields and loaded as NULL. Empty strings of the source
+    are loaded as they are: the CSV writer decides how to quote them, so they are not guaranteed to become NULL
+    as with the EMPTYASNULL option of the Amazon Redshift COPY.
+    """
+
+    table, columns = STAGING_SOURCES[source]
+    num_rows = 0
+    for url in read_manifest(manifest_path):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        with gzip.open(url, 'rt', encoding='utf8') as f:
+            for line in f:
+                obj = json.loads(line)
+                writer.writerow([obj.get(column) for column in columns])
+                num_rows += 1
+
+        buffer.seek(0)
+        cur.copy_expert('COPY {}({}) FROM STDIN WITH (FORMAT csv)'.format(table, ', '.join(columns)), buffer)
+    conn.commit()
+
+    print('{} rows are copied to {}.'.format(num_rows, table))
+
+
+def main():
+    """Prepare staging data for the manifest COPY and optionally load it to the local PostgreSQL stand-in."""
+
+    parser = argparse.ArgumentParser(
+        description='Coalesce small JSON files to gzip chunks and write COPY manifests and JSONPaths.')
+    parser.add_argument('--log-data', default='log_data', help='local directory with log files')
+    parser.add_argument('--song-data', default='song_data', help='local directory with song files')
+    parser.add_argument('--output', default='staging', help='output directory for chunks, manifests and JSONPaths')
+    parser.add_argument('--slices', type=int, default=8, help='number of slices in the Amazon Redshift cluster')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='maximum uncompressed size of the chunk in bytes')
+    parser.add_argument('--url-prefix', default=None,
+                        help='S3 location the output directory is uploaded to, local paths are used by default')
+    parser.add_argument('--min-ts', type=int, default=None,
+                        help='stage only events with ts greater than this high-water mark (printed by etl.py), '
+                             'log files modified before it are skipped')
+    parser.add_argument('--songs-since', type=int, default=None,
+                        help='stage only song files modified at or after this time in milliseconds since the epoch '
+                             '(high-water mark of songs printed by etl.py)')
+    parser.add_argument('--local-dsn', default=None,
+                        help='load chunks to staging tables of the local PostgreSQL database, e.g. "dbname=sparkifydb"')
+    args = parser.parse_args()
+
+    # events are written to the log file before its modification time,
+    # so the log file modified before the high-water mark has no newer events
+    manifests = {
+        'events': prepare_source('events', args.log_data, args.output, args.slices, args.chunk_size, args.url_prefix,
+                                 min_ts=args.min_ts, min_mtime=args.min_ts),
+        'songs': prepare_source('songs', args.song_data, args.output, args.slices, args.chunk_size, args.url_prefix,
+                                min_mtime=args.songs_since),
+    }
+
+    if args.local_dsn:
+        if args.url_prefix:
+            parser.error('chunks can be loaded to the local database only with local paths in the manifests')
+
+        # psycopg2 is required only for the local load, chunks and manifests are prepared without it
+        import psycopg2
+
+        conn = psycopg2.connect(args.local_dsn)
+        cur = conn.cursor()
+        for source, manifest_path in manifests.items():
+            table, _ = STAGING_SOURCES[source]
+            cur.execute('TRUNCATE {};'.format(table))
+            copy_local(cur, conn, source, manifest_path)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
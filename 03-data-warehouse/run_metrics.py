@@ -0,0 +1,140 @@
+import time
+import uuid
+import argparse
+import datetime
+import threading
+import statistics
+import configparser
+from collections import defaultdict
+import psycopg2
+from sql_queries import run_metrics_insert, run_metrics_select
+
+# Amazon Redshift can EXPLAIN only these statements, COPY and multi-statement queries are executed without a plan
+EXPLAIN_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def can_explain(query):
+    """Return True if the query is a single statement which can be explained."""
+
+    query = query.strip().rstrip(';')
+    return query.upper().startswith(EXPLAIN_STATEMENTS) and ';' not in query
+
+
+class RunMetrics:
+    """
+        Metrics of the statements executed during one ETL run: start time, duration, number of affected rows
+        and optionally the query plan. Statements can be executed from several threads.
+    """
+
+    def __init__(self, run_id=None, explain=False):
+        self.run_id = run_id or str(uuid.uuid4())
+        self.explain = explain
+        self.records = []
+        self.lock = threading.Lock()
+
+    def execute(self, cur, name, query, params=None):
+        """Execute the query with the cursor and record its metrics under the statement name."""
+
+        plan = None
+        if self.explain and can_explain(query):
+            cur.execute('EXPLAIN ' + query, params)
+            plan = '\n'.join(row[0] for row in cur.fetchall())
+
+        started_at = datetime.datetime.now()
+        start = time.perf_counter()
+        cur.execute(query, params)
+        duration = time.perf_counter() - start
+
+        # rowcount of the last statement only for multi-statement queries, -1 if it is unknown
+        row_count = cur.rowcount if cur.rowcount >= 0 else None
+        with self.lock:
+            self.records.append((self.run_id, name, started_at, duration, row_count, plan))
+
+    def save(self, cur, conn):
+        """Store recorded metrics to the `etl_run_metrics` table."""
+
+        with self.lock:
+            records = list(self.records)
+        cur.executemany(run_metrics_insert, records)
+        conn.commit()
+        print('Metrics of {} statements are saved for run {}.'.format(len(records), self.run_id))
+
+
+def load_runs(cur):
+    """Return metrics of all runs in order of their start: list of (run_id, {statement: (duration, rows, plan)})."""
+
+    cur.execute(run_metrics_select)
+    runs = defaultdict(dict)
+    started = {}
+    for run_id, statement, started_at, duration, row_count, plan in cur.fetchall():
+        runs[run_id][statement] = (duration, row_count, plan)
+        started[run_id] = min(started.get(run_id, started_at), started_at)
+
+    return [(run_id, runs[run_id]) for run_id in sorted(runs, key=started.get)]
+
+
+def report(runs, trailing=5, threshold=1.5):
+    """
+        Compare every statement of the latest run with the median duration of the same statement
+        in the `trailing` previous runs. Statements slower than `threshold` times the median are flagged,
+        as well as statements whose plan differs from the plan of the previous run.
+        Return number of flagged statements.
+    """
+
+    if not runs:
+        print('There are no runs to report.')
+        return 0
+
+    run_id, latest = runs[-1]
+    previous = [statements for _, statements in runs[-trailing - 1:-1]]
+    print('Run {} compared with {} previous runs:'.format(run_id, len(previous)))
+    print('{:<30} {:>10} {:>10} {:>8} {:>12}  {}'.format('statement', 'time, s', 'median, s', 'ratio', 'rows', 'flags'))
+
+    flagged = 0
+    for statement, (duration, row_count, plan) in latest.items():
+        durations = [statements[statement][0] for statements in previous if statement in statements]
+        median = statistics.median(durations) if durations else None
+        ratio = duration / median if median else None
+
+        flags = []
+        if ratio is not None and ratio > threshold:
+            flags.append('SLOW')
+        plans = [statements[statement][2] for statements in previous if statement in statements]
+        if plan and plans and plans[-1] and plan != plans[-1]:
+            flags.append('PLAN CHANGED')
+        flagged += bool(flags)
+
+        print('{:<30} {:>10.2f} {:>10} {:>8} {:>12}  {}'.format(
+            statement, duration, '-' if median is None else '{:.2f}'.format(median),
+            '-' if ratio is None else '{:.2f}'.format(ratio), '-' if row_count is None else row_count,
+            ' '.join(flags)).rstrip())
+
+    print('{} statements are flagged.'.format(flagged))
+    return flagged
+
+
+def main():
+    """Report statement durations of the latest ETL run against the trailing median of the previous runs."""
+
+    parser = argparse.ArgumentParser(description='Compare the latest ETL run with the previous runs.')
+    parser.add_argument('--trailing', type=int, default=5, help='number of previous runs to compute the median')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='flag statements slower than this ratio to the median')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    try:
+        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+        cur = conn.cursor()
+    except psycopg2.Error as e:
+        print('Could not connect to the Amazon Redshift cluster. Error: "%r"' % e)
+        return
+
+    report(load_runs(cur), args.trailing, args.threshold)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
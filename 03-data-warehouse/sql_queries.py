@@ -10,6 +10,10 @@ LOG_DATA = config.get('S3', 'LOG_DATA')
 LOG_JSONPATH = config.get('S3', 'LOG_JSONPATH')
 SONG_DATA = config.get('S3', 'SONG_DATA')
 REGION = config.get('S3', 'REGION')
+EVENTS_MANIFEST = config.get('STAGING', 'EVENTS_MANIFEST')
+EVENTS_JSONPATH = config.get('STAGING', 'EVENTS_JSONPATH')
+SONGS_MANIFEST = config.get('STAGING', 'SONGS_MANIFEST')
+SONGS_JSONPATH = config.get('STAGING', 'SONGS_JSONPATH')
 
 # CREATE SCHEMAS
 
@@ -24,6 +28,7 @@ user_table_drop = "DROP TABLE IF EXISTS users;"
 song_table_drop = "DROP TABLE IF EXISTS songs;"
 artist_table_drop = "DROP TABLE IF EXISTS artists;"
 time_table_drop = "DROP TABLE IF EXISTS time;"
+watermark_table_drop = "DROP TABLE IF EXISTS etl_watermarks;"
 
 # CREATE TABLES
 
@@ -62,7 +67,8 @@ staging_songs_table_create = ("""
         song_id char(18),
         title text,
         duration numeric,
-        year int
+        year int,
+        source_mtime bigint
     );
 """)
 
@@ -127,23 +133,56 @@ time_table_create = ("""
     DISTSTYLE ALL;
 """)
 
+# High-water mark of every source which is already loaded to the star schema.
+# For `events` source it is the maximum `ts` of the loaded events.
+watermark_table_create = ("""
+    CREATE TABLE etl_watermarks(
+        source varchar(100) NOT NULL,
+        max_ts bigint NOT NULL,
+        updated_at timestamp NOT NULL
+    )
+    DISTSTYLE ALL;
+""")
+
+# Metrics of the statements executed by `etl.py`, one row per run and statement, see `run_metrics.py`.
+# The table keeps history of the runs, so it is not dropped when the tables are re-created.
+run_metrics_table_create = ("""
+    CREATE TABLE IF NOT EXISTS etl_run_metrics(
+        run_id varchar(36) NOT NULL,
+        statement varchar(100) NOT NULL,
+        started_at timestamp NOT NULL,
+        duration double precision NOT NULL,
+        row_count bigint,
+        explain_plan varchar(65535),
+        PRIMARY KEY (run_id, statement)
+    )
+    DISTSTYLE ALL;
+""")
+
 # STAGING TABLES
+# Source files are coalesced by `prepare_staging.py` to gzip chunks, number of chunks is a multiple of the number
+# of slices, so every slice loads the same amount of data. Chunks are listed in the manifest and columns are
+# extracted with explicit JSONPaths instead of 'auto', so the load does not depend on the field names matching.
 
 staging_events_copy = ("""
     COPY stg.events
     FROM {}
     IAM_ROLE {}
     FORMAT AS JSON {}
+    GZIP
+    MANIFEST
     REGION {};
-""").format(LOG_DATA, IAM_ROLE, LOG_JSONPATH, REGION)
+""").format(EVENTS_MANIFEST, IAM_ROLE, EVENTS_JSONPATH, REGION)
 
 staging_songs_copy = ("""
     COPY stg.songs
     FROM {}
     IAM_ROLE {}
-    FORMAT AS JSON 'auto'
+    FORMAT AS JSON {}
+    GZIP
+    MANIFEST
     REGION {};
-""").format(SONG_DATA, IAM_ROLE, REGION)
+""").format(SONGS_MANIFEST, IAM_ROLE, SONGS_JSONPATH, REGION)
 
 # FINAL TABLES
 # During `songplays` loading we want to separate songs with same name from each other, thus we have to join by
@@ -264,13 +303,315 @@ time_table_insert = ("""
     FROM stg.events;
 """)
 
+# INCREMENTAL LOAD
+# Staging tables are truncated before COPY and events which are not newer than the high-water mark are removed
+# after COPY, so the merge below processes the delta only. `prepare_staging.py` stages only log files modified
+# after the `events` high-water mark and song files modified since the `songs` high-water mark (maximum
+# modification time of the staged song files), so `stg.songs` holds new and changed songs only and songplays
+# are matched with the `songs` and `artists` tables instead.
+# `songplays` and `time` are merged with delete-then-insert on their natural keys,
+# `users`, `songs` and `artists` are upserted: existing rows are updated and new rows are inserted.
+# Their deltas keep a single row per key with ROW_NUMBER(), so a key staged with different attribute values
+# does not match the target row twice in UPDATE and is not inserted twice. Rows which are equal to the existing
+# ones are removed from the deltas, so re-staged songs and artists of the changed files are not rewritten.
+# All merge statements are executed in a single transaction together with the high-water mark update.
+
+staging_events_truncate = "TRUNCATE stg.events;"
+staging_songs_truncate = "TRUNCATE stg.songs;"
+
+watermark_select = "SELECT max_ts FROM etl_watermarks WHERE source = %s;"
+
+staging_events_trim = "DELETE FROM stg.events WHERE ts <= %s;"
+
+watermark_update = ("""
+    DELETE FROM etl_watermarks WHERE source IN ('events', 'songs');
+    INSERT INTO etl_watermarks(source, max_ts, updated_at)
+    SELECT 'events', COALESCE(MAX(ts), %s), GETDATE()
+    FROM stg.events
+    UNION ALL
+    SELECT 'songs', COALESCE(MAX(source_mtime), %s), GETDATE()
+    FROM stg.songs;
+""")
+
+songplay_table_merge = ("""
+    DROP TABLE IF EXISTS songplays_delta;
+    CREATE TEMP TABLE songplays_delta AS
+    SELECT TIMESTAMP 'epoch' + e.ts / 1000 * INTERVAL '1 Second' as start_time
+        , e.userId as user_id
+        , e.level
+        , s.song_id
+        , s.artist_id
+        , e.sessionId as session_id
+        , e.location
+        , e.userAgent as user_agent
+    FROM stg.events e
+    INNER JOIN songs s ON s.title = e.song
+                      AND s.duration = e.length
+    INNER JOIN artists a ON a.artist_id = s.artist_id
+                        AND a.name = e.artist
+    WHERE e.Page = 'NextSong';
+
+    DELETE FROM songplays
+    USING songplays_delta d
+    WHERE songplays.start_time = d.start_time
+        AND songplays.user_id = d.user_id
+        AND songplays.session_id = d.session_id
+        AND songplays.song_id = d.song_id;
+
+    INSERT INTO songplays(
+        start_time
+        , user_id
+        , level
+        , song_id
+        , artist_id
+        , session_id
+        , location
+        , user_agent
+    )
+    SELECT start_time
+        , user_id
+        , level
+        , song_id
+        , artist_id
+        , session_id
+        , location
+        , user_agent
+    FROM songplays_delta;
+""")
+
+user_table_merge = ("""
+    DROP TABLE IF EXISTS users_delta;
+    CREATE TEMP TABLE users_delta AS
+    SELECT user_id
+        , first_name
+        , last_name
+        , gender
+        , level
+    FROM (
+        SELECT e.userId as user_id
+            , e.firstName as first_name
+            , e.lastName as last_name
+            , e.gender
+            , e.level
+            , ROW_NUMBER() OVER (PARTITION BY e.userId ORDER BY e.ts DESC, e.itemInSession DESC) as rn
+        FROM stg.events e
+        WHERE e.userId IS NOT NULL
+    ) le
+    WHERE le.rn = 1;
+
+    UPDATE users
+    SET first_name = d.first_name
+        , last_name = d.last_name
+        , gender = d.gender
+        , level = d.level
+    FROM users_delta d
+    WHERE users.user_id = d.user_id;
+
+    INSERT INTO users(
+        user_id
+        , first_name
+        , last_name
+        , gender
+        , level
+    )
+    SELECT d.user_id
+        , d.first_name
+        , d.last_name
+        , d.gender
+        , d.level
+    FROM users_delta d
+    LEFT JOIN users u ON u.user_id = d.user_id
+    WHERE u.user_id IS NULL;
+""")
+
+song_table_merge = ("""
+    DROP TABLE IF EXISTS songs_delta;
+    CREATE TEMP TABLE songs_delta AS
+    SELECT song_id
+        , title
+        , artist_id
+        , year
+        , duration
+    FROM (
+        SELECT song_id
+            , title
+            , artist_id
+            , year
+            , duration
+            , ROW_NUMBER() OVER (PARTITION BY song_id ORDER BY year DESC, duration DESC, artist_id, title) as rn
+        FROM stg.songs
+        WHERE song_id IS NOT NULL
+            AND title IS NOT NULL
+    ) ls
+    WHERE ls.rn = 1;
+
+    DELETE FROM songs_delta
+    USING songs s
+    WHERE s.song_id = songs_delta.song_id
+        AND s.title = songs_delta.title
+        AND (s.artist_id = songs_delta.artist_id OR (s.artist_id IS NULL AND songs_delta.artist_id IS NULL))
+        AND (s.year = songs_delta.year OR (s.year IS NULL AND songs_delta.year IS NULL))
+        AND (s.duration = songs_delta.duration OR (s.duration IS NULL AND songs_delta.duration IS NULL));
+
+    UPDATE songs
+    SET title = d.title
+        , artist_id = d.artist_id
+        , year = d.year
+        , duration = d.duration
+    FROM songs_delta d
+    WHERE songs.song_id = d.song_id;
+
+    INSERT INTO songs(
+        song_id
+        , title
+        , artist_id
+        , year
+        , duration
+    )
+    SELECT d.song_id
+        , d.title
+        , d.artist_id
+        , d.year
+        , d.duration
+    FROM songs_delta d
+    LEFT JOIN songs s ON s.song_id = d.song_id
+    WHERE s.song_id IS NULL;
+""")
+
+artist_table_merge = ("""
+    DROP TABLE IF EXISTS artists_delta;
+    CREATE TEMP TABLE artists_delta AS
+    SELECT artist_id
+        , name
+        , location
+        , latitude
+        , longitude
+    FROM (
+        SELECT artist_id
+            , artist_name as name
+            , artist_location as location
+            , artist_latitude as latitude
+            , artist_longitude as longitude
+            , ROW_NUMBER() OVER (PARTITION BY artist_id
+                                 ORDER BY artist_location, artist_latitude, artist_longitude, artist_name) as rn
+        FROM stg.songs
+        WHERE artist_id IS NOT NULL
+            AND artist_name IS NOT NULL
+    ) la
+    WHERE la.rn = 1;
+
+    DELETE FROM artists_delta
+    USING artists a
+    WHERE a.artist_id = artists_delta.artist_id
+        AND a.name = artists_delta.name
+        AND (a.location = artists_delta.location OR (a.location IS NULL AND artists_delta.location IS NULL))
+        AND (a.latitude = artists_delta.latitude OR (a.latitude IS NULL AND artists_delta.latitude IS NULL))
+        AND (a.longitude = artists_delta.longitude OR (a.longitude IS NULL AND artists_delta.longitude IS NULL));
+
+    UPDATE artists
+    SET name = d.name
+        , location = d.location
+        , latitude = d.latitude
+        , longitude = d.longitude
+    FROM artists_delta d
+    WHERE artists.artist_id = d.artist_id;
+
+    INSERT INTO artists(
+        artist_id
+        , name
+        , location
+        , latitude
+        , longitude
+    )
+    SELECT d.artist_id
+        , d.name
+        , d.location
+        , d.latitude
+        , d.longitude
+    FROM artists_delta d
+    LEFT JOIN artists a ON a.artist_id = d.artist_id
+    WHERE a.artist_id IS NULL;
+""")
+
+time_table_merge = ("""
+    DROP TABLE IF EXISTS time_delta;
+    CREATE TEMP TABLE time_delta AS
+    SELECT DISTINCT TIMESTAMP 'epoch' + ts / 1000 * INTERVAL '1 Second' as start_time
+    FROM stg.events;
+
+    DELETE FROM time
+    USING time_delta d
+    WHERE time.start_time = d.start_time;
+
+    INSERT INTO time(
+        start_time
+        , hour
+        , day
+        , week
+        , month
+        , year
+        , weekday
+    )
+    SELECT start_time
+        , EXTRACT(hour FROM start_time) as hour
+        , EXTRACT(day FROM start_time) as day
+        , EXTRACT(week FROM start_time) as week
+        , EXTRACT(month FROM start_time) as month
+        , EXTRACT(year FROM start_time) as year
+        , EXTRACT(weekday FROM start_time) as weekday
+    FROM time_delta;
+""")
+
+# RUN METRICS
+
+run_metrics_insert = ("""
+    INSERT INTO etl_run_metrics(run_id, statement, started_at, duration, row_count, explain_plan)
+    VALUES (%s, %s, %s, %s, %s, %s);
+""")
+
+run_metrics_select = ("""
+    SELECT run_id
+        , statement
+        , started_at
+        , duration
+        , row_count
+        , explain_plan
+    FROM etl_run_metrics
+    ORDER BY started_at;
+""")
+
 # QUERY LISTS
 
 create_schema_queries = [staging_schema_create]
 create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create,
-                        user_table_create, song_table_create, artist_table_create, time_table_create]
+                        user_table_create, song_table_create, artist_table_create, time_table_create,
+                        watermark_table_create, run_metrics_table_create]
 drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop,
-                      song_table_drop, artist_table_drop, time_table_drop]
+                      song_table_drop, artist_table_drop, time_table_drop, watermark_table_drop]
 copy_table_queries = [staging_events_copy, staging_songs_copy]
 insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert,
                         time_table_insert]
+staging_truncate_queries = [staging_events_truncate, staging_songs_truncate]
+# songs and artists are merged first, songplays of the new events are matched with all songs in the star schema
+merge_table_steps = [
+    ('song_table_merge', song_table_merge),
+    ('artist_table_merge', artist_table_merge),
+    ('songplay_table_merge', songplay_table_merge),
+    ('user_table_merge', user_table_merge),
+    ('time_table_merge', time_table_merge),
+]
+
+# Steps of the full load for the parallel execution with `dag.py`: (name, query, names of steps it depends on).
+# Staging tables are independent of each other and every star schema table is loaded from staging tables only,
+# so each insert waits only for the staging tables it reads.
+copy_table_steps = [
+    ('staging_events_copy', staging_events_copy, []),
+    ('staging_songs_copy', staging_songs_copy, []),
+]
+insert_table_steps = [
+    ('songplay_table_insert', songplay_table_insert, ['staging_events_copy', 'staging_songs_copy']),
+    ('user_table_insert', user_table_insert, ['staging_events_copy']),
+    ('song_table_insert', song_table_insert, ['staging_songs_copy']),
+    ('artist_table_insert', artist_table_insert, ['staging_songs_copy']),
+    ('time_table_insert', time_table_insert, ['staging_events_copy']),
+]